@@ -0,0 +1,102 @@
+"""Synthetic TXT, PDF and DOCX documents for the benchmarks.
+
+Text is drawn from a fixed vocabulary with a seeded generator, so the same
+seed always produces byte-identical files.
+"""
+import io
+import random
+
+WORDS = '''
+cell membrane protein energy enzyme reaction molecule nucleus gene mutation evolution species habitat
+climate carbon oxygen photosynthesis respiration glucose atom electron proton neutron charge field force
+mass velocity acceleration momentum gravity orbit planet star galaxy light wave frequency spectrum
+market price demand supply inflation interest currency trade policy government election parliament
+revolution empire treaty war peace culture language history society economy industry labour capital
+'''.split()
+
+SIZES = {
+    'small': 4000,     # characters
+    'medium': 40000,
+    'large': 400000,
+}
+
+
+def make_text(chars, rng):
+    words = []
+    size = 0
+    sentence = 0
+    while size < chars:
+        word = rng.choice(WORDS)
+        sentence += 1
+        if sentence >= rng.randint(8, 20):
+            word += '.'
+            sentence = 0
+            if rng.random() < 0.2:
+                word += '\n\n'
+        words.append(word)
+        size += len(word) + 1
+    return ' '.join(words)
+
+
+def _pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_pdf(text, chars_per_page=3000):
+    """Minimal uncompressed PDF with Helvetica text, one text object per page"""
+    pages = [text[i:i + chars_per_page] for i in range(0, len(text), chars_per_page)] or ['']
+    count = len(pages)
+    font_id = 3 + 2 * count
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(count))}] /Count {count} >>",
+    ]
+    for i, page in enumerate(pages):
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R '
+                       f'/Resources << /Font << /F1 {font_id} 0 R >> >> >>')
+        body = f'BT /F1 10 Tf 40 750 Td ({_pdf_escape(" ".join(page.split()))}) Tj ET'
+        objects.append(f'<< /Length {len(body.encode("latin-1"))} >>\nstream\n{body}\nendstream')
+    objects.append('<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    out += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode('latin-1')
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    return bytes(out)
+
+
+def make_docx(text):
+    import docx
+
+    document = docx.Document()
+    for paragraph in text.split('\n\n'):
+        document.add_paragraph(paragraph.strip())
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+CONTENT_TYPES = {
+    'txt': 'text/plain',
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+}
+
+
+def make_document(kind, size, seed):
+    """Return (filename, bytes, content_type) for a document of `kind` (txt, pdf, docx) and `size`"""
+    text = make_text(SIZES[size], random.Random(f'{kind}:{size}:{seed}'))
+    if kind == 'txt':
+        data = text.encode('utf-8')
+    elif kind == 'pdf':
+        data = make_pdf(text)
+    elif kind == 'docx':
+        data = make_docx(text)
+    else:
+        raise ValueError(f'Unknown document kind {kind!r}')
+    return f'{kind}-{size}-{seed}.{kind}', data, CONTENT_TYPES[kind]
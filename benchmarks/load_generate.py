@@ -0,0 +1,262 @@
+"""Load test for concurrent quiz generation through a real gunicorn process.
+
+Starts a local fake of the OpenAI chat completions endpoint with a fixed
+latency, runs gunicorn with gunicorn.conf.py against a throwaway SQLite
+database (or DATABASE_URL) with OPENAI_BASE_URL pointing at the fake, and
+fires --requests generations with --concurrency clients. Reports latency
+percentiles, throughput, the peak number of generations the process had
+waiting on the upstream at once (each request carries its own custom prompt,
+so the fake tells them apart) and the peak number of completions in flight,
+higher because every generation fans out into one completion per chunk:
+
+    python benchmarks/load_generate.py --threads 256 --concurrency 300 --requests 1200
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GENERATION_KEY = re.compile(r'Additional instructions: (load \d+)')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.corpus import make_document  # noqa: E402
+from benchmarks.run import summarize  # noqa: E402
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), FakeCompletionHandler)
+        self.latency = latency
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.generations = {}  # custom prompt -> completions in flight for that generation
+        self.peak_generations = 0
+        self.completions = 0
+        self.lock = threading.Lock()
+
+
+class FakeCompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        prompt = body['messages'][-1]['content']
+        match = GENERATION_KEY.search(prompt)
+        key = match.group(1) if match else None
+        with server.lock:
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+            if key:
+                server.generations[key] = server.generations.get(key, 0) + 1
+                server.peak_generations = max(server.peak_generations, len(server.generations))
+        try:
+            time.sleep(server.latency)
+            count = int(prompt.split('generate exactly ', 1)[1].split()[0])
+            questions = [{'id': i + 1, 'question': f'Load question {i + 1}?',
+                          'options': ['A', 'B', 'C', 'D'], 'correct_answer': i % 4,
+                          'explanation': 'Fake upstream.'} for i in range(count)]
+            payload = json.dumps({
+                'id': 'chatcmpl-load', 'object': 'chat.completion', 'created': int(time.time()),
+                'model': body.get('model'),
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': json.dumps({'questions': questions})}}],
+                'usage': {'prompt_tokens': 100, 'completion_tokens': 100 * count, 'total_tokens': 100 + 100 * count}
+            }).encode('utf-8')
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+                server.completions += 1
+                if key:
+                    remaining = server.generations.pop(key) - 1
+                    if remaining:
+                        server.generations[key] = remaining
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self.cookie = None
+
+    def request(self, method, path, body=None, headers=None, timeout=300):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+        try:
+            headers = dict(headers or {})
+            if self.cookie:
+                headers['Cookie'] = self.cookie
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+            cookie = response.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';', 1)[0]
+            return response.status, data
+        finally:
+            connection.close()
+
+    def post_json(self, path, payload):
+        status, data = self.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+        return status, json.loads(data) if data else None
+
+    def upload(self, name, data, content_type):
+        boundary = 'loadtestboundary'
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n').encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        status, data = self.request('POST', '/api/documents/upload', body,
+                                    {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        return status, json.loads(data)
+
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError('gunicorn did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=256, help='GUNICORN_THREADS for the single worker')
+    parser.add_argument('--concurrency', type=int, default=300, help='Concurrent client connections')
+    parser.add_argument('--requests', type=int, default=1200)
+    parser.add_argument('--latency', type=float, default=2.0, help='Seconds the fake upstream takes per completion')
+    parser.add_argument('--question-count', type=int, default=10)
+    parser.add_argument('--users', type=int, default=50, help='Accounts the requests are spread over')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.latency)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+    directory = tempfile.mkdtemp(prefix='examizing-load-')
+    port = free_port()
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(directory, 'load.db')}")
+    env.update({
+        'OPENAI_API_KEY': env.get('OPENAI_API_KEY', 'load-test'),
+        'OPENAI_BASE_URL': f'http://127.0.0.1:{upstream.server_address[1]}/v1',
+        'UPLOAD_FOLDER': os.path.join(directory, 'uploads'),
+        'WEB_CONCURRENCY': '1',
+        'GUNICORN_THREADS': str(args.threads),
+        'QUIZ_CACHE_ENABLED': '0',
+        'QUIZ_GENERATION_CLIENT': env.get('QUIZ_GENERATION_CLIENT', 'thread'),
+        'LLM_RATE': '0',
+        'LLM_MAX_CONCURRENCY': str(max(args.threads * 2, 16)),
+        'LLM_USER_CONCURRENCY': str(args.concurrency),
+        'LLM_MAX_RETRIES': '0',
+        'DB_POOL_SIZE': env.get('DB_POOL_SIZE', '20'),
+        'DB_MAX_OVERFLOW': env.get('DB_MAX_OVERFLOW', '20'),
+    })
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'src.main', 'migrate'],
+                   cwd=ROOT, env=env, check=True, capture_output=True)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '-b', f'127.0.0.1:{port}', '--backlog', '2048', 'src.main:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=open(os.path.join(directory, 'gunicorn.log'), 'w')
+    )
+    try:
+        wait_for_port(port, server)
+
+        users = []
+        for index in range(args.users):
+            client = Client(port)
+            status, _ = client.post_json('/api/auth/register', {'email': f'load{index}@example.com', 'password': 'load-password'})
+            assert status == 201, status
+            client.post_json('/api/auth/tokens/add', {'tokens': 1_000_000})
+            name, data, content_type = make_document('txt', 'small', f'load-{index}')
+            status, body = client.upload(name, data, content_type)
+            assert status == 201, body
+            users.append((client, body['document']['id']))
+        for client, document_id in users:
+            while True:
+                status, data = client.request('GET', f'/api/documents/{document_id}')
+                if json.loads(data)['document']['status'] != 'pending':
+                    break
+                time.sleep(0.05)
+
+        error_samples = {}
+
+        def call(index):
+            client, document_id = users[index % len(users)]
+            started = time.perf_counter()
+            try:
+                status, body = client.post_json('/api/quiz/generate', {
+                    'document_id': document_id, 'question_count': args.question_count,
+                    'custom_prompt': f'load {index}'})
+                if status >= 400:
+                    error_samples.setdefault(status, (body or {}).get('error'))
+                status = str(status)
+            except Exception:
+                status = 'exception'
+            return time.perf_counter() - started, status
+
+        upstream.peak_in_flight = 0
+        upstream.peak_generations = 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(call, range(args.requests)))
+        wall = time.perf_counter() - started
+
+        statuses = {}
+        for _, status in results:
+            statuses[status] = statuses.get(status, 0) + 1
+        summary = summarize([latency for latency, _ in results], statuses, wall)
+        summary.update({
+            'upstream_latency_s': args.latency,
+            'peak_generations_in_flight': upstream.peak_generations,
+            'peak_upstream_in_flight': upstream.peak_in_flight,
+            'upstream_completions': upstream.completions,
+            'gunicorn_threads': args.threads,
+            'concurrency': args.concurrency,
+            'generation_client': env['QUIZ_GENERATION_CLIENT'],
+            'error_samples': {str(status): error for status, error in error_samples.items()},
+        })
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        upstream.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(json.dumps(summary, indent=2, sort_keys=True))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(summary, file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""Offline benchmark suite for the upload, extraction, generation, grading, auth and list paths.
+
+Boots the app in-process against a throwaway SQLite database, replaces the
+OpenAI client with benchmarks/stub_openai.py and drives the endpoints through
+Flask test clients, one per concurrent worker. Prints a summary and writes
+JSON that can be compared between commits:
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.corpus import make_document, SIZES, CONTENT_TYPES  # noqa: E402
+from benchmarks.stub_openai import StubOpenAI, AsyncStubOpenAI  # noqa: E402
+
+SCENARIOS = [
+    'auth_login', 'auth_me', 'upload', 'extraction', 'generate', 'generate_stream', 'generate_fast',
+    'submit', 'submit_batch', 'list_documents', 'list_quizzes', 'list_results', 'search_documents', 'search_quizzes',
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, statuses, wall):
+    latencies = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if status == 'exception' or int(status) >= 400)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': dict(statuses),
+        'wall_s': round(wall, 4),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'mean_ms': to_ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': to_ms(percentile(latencies, 0.50)),
+        'p90_ms': to_ms(percentile(latencies, 0.90)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+        'max_ms': to_ms(latencies[-1]) if latencies else None,
+    }
+
+
+def run_concurrently(workers, total, call):
+    """Run `total` calls spread over the workers; call(worker, index) returns an HTTP status"""
+    latencies = []
+    statuses = Counter()
+
+    def work(worker_index):
+        results = []
+        for index in range(worker_index, total, len(workers)):
+            started = time.perf_counter()
+            try:
+                status = str(call(workers[worker_index], index))
+            except Exception:
+                status = 'exception'
+            results.append((time.perf_counter() - started, status))
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+        for results in executor.map(work, range(len(workers))):
+            for latency, status in results:
+                latencies.append(latency)
+                statuses[status] += 1
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+class Worker:
+    """A logged-in test client with its own user, document and quiz"""
+
+    def __init__(self, app, index):
+        self.client = app.test_client()
+        self.email = f'bench{index}@example.com'
+        self.password = 'benchmark-password'
+        self.document_id = None
+        self.quiz_id = None
+        self.answers = None
+
+    def post(self, path, **kwargs):
+        return self.client.post(path, **kwargs)
+
+
+def wait_until_ready(worker, document_id, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = worker.client.get(f'/api/documents/{document_id}').json['document']['status']
+        if status != 'pending':
+            return status
+        time.sleep(0.02)
+    raise TimeoutError(f'Document {document_id} still pending after {timeout}s')
+
+
+def setup_workers(app, count):
+    workers = []
+    for index in range(count):
+        worker = Worker(app, index)
+        response = worker.post('/api/auth/register', json={'email': worker.email, 'password': worker.password})
+        assert response.status_code == 201, response.json
+        worker.post('/api/auth/tokens/add', json={'tokens': 1_000_000})
+
+        name, data, content_type = make_document('txt', 'medium', f'setup-{index}')
+        response = worker.post('/api/documents/upload',
+                               data={'file': (io.BytesIO(data), name, content_type)},
+                               content_type='multipart/form-data')
+        worker.document_id = response.json['document']['id']
+        workers.append(worker)
+
+    for worker in workers:
+        wait_until_ready(worker, worker.document_id)
+        response = worker.post('/api/quiz/generate', json={'document_id': worker.document_id, 'question_count': 10})
+        assert response.status_code == 201, response.json
+        worker.quiz_id = response.json['quiz_id']
+        worker.answers = [question['correct_answer'] for question in response.json['questions']]
+    return workers
+
+
+def bench_uploads(workers, args):
+    results = {}
+    for kind in args.kinds:
+        for size in args.sizes:
+            # Every request uploads distinct bytes so deduplication does not short-circuit it
+            files = [make_document(kind, size, f'upload-{i}') for i in range(args.requests)]
+
+            def call(worker, index):
+                name, data, content_type = files[index]
+                return worker.post('/api/documents/upload',
+                                   data={'file': (io.BytesIO(data), name, content_type)},
+                                   content_type='multipart/form-data').status_code
+
+            results[f'upload_{kind}_{size}'] = run_concurrently(workers, args.requests, call)
+
+    # The same kinds and sizes in batches of ten files per request
+    requests = max(1, args.requests // 10)
+    combinations = [(kind, size) for kind in args.kinds for size in args.sizes]
+    batches = [[make_document(*combinations[j % len(combinations)], f'batch-{i}-{j}') for j in range(10)]
+               for i in range(requests)]
+
+    def call_batch(worker, index):
+        return worker.post('/api/documents/upload/batch',
+                           data={'files': [(io.BytesIO(data), name, content_type)
+                                           for name, data, content_type in batches[index]]},
+                           content_type='multipart/form-data').status_code
+
+    results['upload_batch'] = run_concurrently(workers, requests, call_batch)
+    return results
+
+
+def bench_extraction(args, directory):
+    from src.services.extraction import extract_pages
+
+    results = {}
+    for kind in args.kinds:
+        for size in args.sizes:
+            name, data, content_type = make_document(kind, size, 'extraction')
+            path = os.path.join(directory, name)
+            with open(path, 'wb') as file:
+                file.write(data)
+
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(args.extraction_runs):
+                call_started = time.perf_counter()
+                extract_pages(path, content_type)
+                latencies.append(time.perf_counter() - call_started)
+            summary = summarize(latencies, Counter({'200': len(latencies)}), time.perf_counter() - started)
+            summary['bytes'] = len(data)
+            results[f'extraction_{kind}_{size}'] = summary
+    return results
+
+
+def bench_endpoints(workers, args, scenarios):
+    sheets = [{'participant': f'student {i}', 'answers': [i % 4] * 10} for i in range(args.batch_size)]
+    calls = {
+        'auth_login': lambda w, i: w.post('/api/auth/login', json={'email': w.email, 'password': w.password}).status_code,
+        'auth_me': lambda w, i: w.client.get('/api/auth/me').status_code,
+        'generate': lambda w, i: w.post('/api/quiz/generate', json={
+            'document_id': w.document_id, 'question_count': args.question_count,
+            'custom_prompt': f'variant {i}'}).status_code,
+        'generate_stream': lambda w, i: _drain(w.post('/api/quiz/generate/stream', json={
+            'document_id': w.document_id, 'question_count': args.question_count,
+            'custom_prompt': f'stream variant {i}'}, buffered=False)),
+        'generate_fast': lambda w, i: w.post('/api/quiz/generate', json={
+            'document_id': w.document_id, 'question_count': args.question_count,
+            'custom_prompt': f'variant {i}', 'mode': 'fast'}).status_code,
+        'submit': lambda w, i: w.post(f'/api/quiz/{w.quiz_id}/submit', json={'answers': w.answers}).status_code,
+        'submit_batch': lambda w, i: w.post(f'/api/quiz/{w.quiz_id}/submit/batch',
+                                            json={'submissions': sheets}).status_code,
+        'list_documents': lambda w, i: w.client.get('/api/documents/?limit=50').status_code,
+        'list_quizzes': lambda w, i: w.client.get('/api/quiz/?limit=50').status_code,
+        'list_results': lambda w, i: w.client.get('/api/quiz/results?limit=50').status_code,
+        'search_documents': lambda w, i: w.client.get('/api/search/documents?q=energy+market&limit=20').status_code,
+        'search_quizzes': lambda w, i: w.client.get('/api/search/quizzes?q=benchmark&limit=20').status_code,
+    }
+    results = {}
+    for name in scenarios:
+        if name in calls:
+            total = args.llm_requests if name.startswith('generate') else args.requests
+            results[name] = run_concurrently(workers, total, calls[name])
+    return results
+
+
+def _drain(response):
+    for _ in response.response:
+        pass
+    response.close()
+    return response.status_code
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)['scenarios']
+    print(f"\n{'scenario':<32} {'p50 ms':>18} {'p99 ms':>18} {'req/s':>18}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p99_ms', 'throughput_rps'):
+            old, new = previous.get(key), current.get(key)
+            change = f'{(new - old) / old * 100:+.0f}%' if old and new is not None else 'n/a'
+            cells.append(f'{new} ({change})')
+        print(f'{name:<32} {cells[0]:>18} {cells[1]:>18} {cells[2]:>18}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated subset of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--llm-requests', type=int, default=40, help='Requests per generation scenario')
+    parser.add_argument('--kinds', default='txt,pdf,docx')
+    parser.add_argument('--sizes', default='small,medium', help='Any of ' + ', '.join(SIZES))
+    parser.add_argument('--extraction-runs', type=int, default=5)
+    parser.add_argument('--question-count', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=100, help='Answer sheets per batch submission')
+    parser.add_argument('--llm-latency-ms', type=float, default=800.0)
+    parser.add_argument('--llm-jitter-ms', type=float, default=200.0)
+    parser.add_argument('--llm-failure-rate', type=float, default=0.0)
+    parser.add_argument('--quiz-cache', action='store_true', help='Keep the quiz cache enabled')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Baseline JSON to compare against')
+    args = parser.parse_args()
+    args.kinds = [kind for kind in args.kinds.split(',') if kind in CONTENT_TYPES]
+    args.sizes = [size for size in args.sizes.split(',') if size in SIZES]
+    scenarios = [name for name in args.scenarios.split(',') if name in SCENARIOS]
+
+    directory = tempfile.mkdtemp(prefix='examizing-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    os.environ['UPLOAD_FOLDER'] = os.path.join(directory, 'uploads')
+    os.environ['DB_AUTO_MIGRATE'] = '1'
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    # The stub has no rate limit to protect, a throttled gateway would turn generate runs into fallback runs
+    os.environ.setdefault('LLM_RATE', '0')
+    if not args.quiz_cache:
+        os.environ['QUIZ_CACHE_ENABLED'] = '0'
+
+    try:
+        from src.main import app
+        import src.routes.quiz as quiz_routes
+        quiz_routes.client = StubOpenAI(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms,
+                                        failure_rate=args.llm_failure_rate, seed=args.seed)
+        # QUIZ_GENERATION_CLIENT=async generation goes through the async client, backed by the same stub
+        quiz_routes.make_async_openai_client = lambda: AsyncStubOpenAI(quiz_routes.client.chat.completions)
+
+        workers = setup_workers(app, args.concurrency)
+        results = {}
+        for name in scenarios:
+            if name == 'upload':
+                results.update(bench_uploads(workers, args))
+            elif name == 'extraction':
+                results.update(bench_extraction(args, directory))
+            else:
+                results.update(bench_endpoints(workers, args, [name]))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'scenarios': results,
+    }
+
+    print(f"{'scenario':<32} {'req':>6} {'err':>5} {'req/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for name, summary in results.items():
+        print(f"{name:<32} {summary['requests']:>6} {summary['errors']:>5} {summary['throughput_rps']:>9} "
+              f"{summary['p50_ms']:>9} {summary['p90_ms']:>9} {summary['p99_ms']:>9}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
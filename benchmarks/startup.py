@@ -0,0 +1,89 @@
+"""Measure how long a worker takes to import the application.
+
+Runs `import src.main` in fresh interpreters with `-X importtime` and reports
+the wall time of the import plus the slowest modules by cumulative import
+time, averaged over the runs.
+
+    python benchmarks/startup.py --runs 5 --top 25 --json startup.json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def run_once(module):
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    code = f'import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)'
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    wall = time.perf_counter() - started
+
+    modules = {}
+    for line in process.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = {
+                'self_ms': int(self_us) / 1000,
+                'cumulative_ms': int(cumulative_us) / 1000,
+                'depth': len(indent) // 2
+            }
+    return {
+        'import_s': float(process.stdout.strip().splitlines()[-1]),
+        'process_s': wall,
+        'modules': modules
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='src.main')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--json', help='Write the averaged results to this file')
+    args = parser.parse_args()
+
+    runs = [run_once(args.module) for _ in range(args.runs)]
+    names = set().union(*(run['modules'] for run in runs))
+    modules = {}
+    for name in names:
+        samples = [run['modules'][name] for run in runs if name in run['modules']]
+        modules[name] = {
+            'self_ms': statistics.mean(sample['self_ms'] for sample in samples),
+            'cumulative_ms': statistics.mean(sample['cumulative_ms'] for sample in samples),
+            'depth': samples[0]['depth']
+        }
+
+    result = {
+        'module': args.module,
+        'runs': args.runs,
+        'import_s': statistics.median(run['import_s'] for run in runs),
+        'process_s': statistics.median(run['process_s'] for run in runs),
+        'modules': modules
+    }
+
+    print(f"{args.module}: import {result['import_s'] * 1000:.0f} ms, "
+          f"interpreter total {result['process_s'] * 1000:.0f} ms (median of {args.runs})")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, timing in sorted(modules.items(), key=lambda item: item[1]['cumulative_ms'], reverse=True)[:args.top]:
+        print(f"{timing['cumulative_ms']:14.1f} {timing['self_ms']:9.1f}  {'  ' * timing['depth']}{name}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(result, file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
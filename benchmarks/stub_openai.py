@@ -0,0 +1,104 @@
+"""Offline stand-in for the OpenAI client used by src/routes/quiz.py.
+
+Implements chat.completions.create for plain and streamed calls, answering
+with well-formed quiz JSON after a configurable, seeded latency.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+_QUESTION_COUNT = re.compile(r'generate exactly (\d+)')
+
+
+class StubCompletions:
+    def __init__(self, latency_ms=800.0, jitter_ms=200.0, stream_chunk_chars=16, seed=0, failure_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.stream_chunk_chars = stream_chunk_chars
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            delay = max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+            failed = self._rng.random() < self.failure_rate
+        return call, delay, failed
+
+    def _content(self, messages, call):
+        match = _QUESTION_COUNT.search(messages[-1]['content'])
+        count = int(match.group(1)) if match else 5
+        questions = [{
+            'id': i + 1,
+            'question': f'Benchmark question {call}.{i + 1}?',
+            'options': ['Option A', 'Option B', 'Option C', 'Option D'],
+            'correct_answer': i % 4,
+            'explanation': 'Generated by the benchmark stub.'
+        } for i in range(count)]
+        return json.dumps({'questions': questions})
+
+    def create(self, model=None, messages=(), stream=False, **kwargs):
+        call, delay, failed = self._draw()
+        content = self._content(messages, call)
+        usage = SimpleNamespace(prompt_tokens=sum(len(m['content']) for m in messages) // 4,
+                                completion_tokens=len(content) // 4,
+                                total_tokens=0)
+
+        if not stream:
+            time.sleep(delay)
+            if failed:
+                raise RuntimeError('Stub completion failure')
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+        def events():
+            # Half the latency before the first token, the rest spread over the stream
+            time.sleep(delay / 2)
+            if failed:
+                raise RuntimeError('Stub completion failure')
+            pieces = range(0, len(content), self.stream_chunk_chars)
+            pause = delay / 2 / max(1, len(pieces))
+            for start in pieces:
+                time.sleep(pause)
+                chunk = content[start:start + self.stream_chunk_chars]
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=chunk))], usage=None)
+            yield SimpleNamespace(choices=[], usage=usage)
+
+        return events()
+
+
+class AsyncStubCompletions:
+    """Async face of a StubCompletions, sharing its seeded latency and call count"""
+
+    def __init__(self, completions):
+        self._completions = completions
+
+    async def create(self, model=None, messages=(), stream=False, **kwargs):
+        call, delay, failed = self._completions._draw()
+        await asyncio.sleep(delay)
+        if failed:
+            raise RuntimeError('Stub completion failure')
+        content = self._completions._content(messages, call)
+        usage = SimpleNamespace(prompt_tokens=sum(len(m['content']) for m in messages) // 4,
+                                completion_tokens=len(content) // 4,
+                                total_tokens=0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+class StubOpenAI:
+    def __init__(self, **options):
+        self.chat = SimpleNamespace(completions=StubCompletions(**options))
+
+
+class AsyncStubOpenAI:
+    def __init__(self, completions):
+        self.chat = SimpleNamespace(completions=AsyncStubCompletions(completions))
+
+    async def close(self):
+        pass
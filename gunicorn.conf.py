@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+
+# Prometheus multiprocess mode: each worker writes its samples to this
+# directory and /metrics merges them, whichever worker serves the scrape
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'examizing-metrics'))
+
+
+def on_starting(server):
+    # Samples left by a previous run would otherwise be merged into this one
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+# Serving mode. The default is gunicorn's sync worker, one request at a time
+# per process. Quiz generation is almost entirely waiting on OpenAI, so for
+# high concurrency run threaded workers, for example
+#
+#   GUNICORN_THREADS=256 DB_POOL_SIZE=20 DB_MAX_OVERFLOW=20 LLM_MAX_CONCURRENCY=512 \
+#   LLM_RATE=0 gunicorn src.main:app
+#
+# Each in-flight generation then holds its request thread for the whole model
+# call, plus one pool thread per chunk request on the shared OpenAI client.
+# QUIZ_GENERATION_CLIENT=async runs the chunks on an event loop instead, with
+# a client per generation, which saves the pool threads but not the request
+# thread and gives up connection reuse. benchmarks/load_generate.py
+# measures how many generations a process keeps in flight; each one has about
+# question_count / QUIZ_QUESTIONS_PER_CHUNK completions open upstream, so size
+# LLM_MAX_CONCURRENCY for that fan-out rather than for the thread count.
+#
+# Logins hash on a small pool (PASSWORD_HASH_WORKERS) rather than on these
+# threads. Logins beyond PASSWORD_HASH_MAX_PENDING get a 503 right away instead
+# of holding a thread while they queue; clients retry.
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
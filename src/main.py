@@ -5,49 +5,85 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory
 from flask_cors import CORS
+import click
 from src.models.user import db
 from src.routes.user import user_bp
 from src.routes.auth import auth_bp
 from src.routes.documents import documents_bp
 from src.routes.quiz import quiz_bp
+from src.routes.stats import stats_bp
+from src.routes.search import search_bp
+from src.services.database import normalize_database_url, engine_options, configure_database
+from src.services.schema import migrate
+from src.services.metrics import init_metrics
+from src.services.static_assets import StaticManifest
 
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
-app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
-
-# Enable CORS for all routes
-CORS(app, supports_credentials=True)
-
-# Register blueprints
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(auth_bp, url_prefix='/api/auth')
-app.register_blueprint(documents_bp, url_prefix='/api/documents')
-app.register_blueprint(quiz_bp, url_prefix='/api/quiz')
-
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-
-db.init_app(app)
-with app.app_context():
-    db.create_all()
-
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-            return "Static folder not configured", 404
-
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
+def create_app():
+    """Build the application without touching the database schema; run `flask --app src.main migrate` for that"""
+    app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+    app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+
+    # Enable CORS for all routes
+    CORS(app, supports_credentials=True)
+
+    # Register blueprints
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(documents_bp, url_prefix='/api/documents')
+    app.register_blueprint(quiz_bp, url_prefix='/api/quiz')
+    app.register_blueprint(stats_bp, url_prefix='/api/stats')
+    app.register_blueprint(search_bp, url_prefix='/api/search')
+
+    # Database configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(os.environ.get('DATABASE_URL'))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+
+    db.init_app(app)
+    init_metrics(app)
+    with app.app_context():
+        configure_database(app, db)
+        # Opt-in for local runs, deployments migrate once in the release phase
+        if os.getenv('DB_AUTO_MIGRATE') == '1':
+            migrate()
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Create missing tables, columns and indexes."""
+        changes = migrate()
+        for change in changes:
+            click.echo(change)
+        click.echo(f'{len(changes)} schema changes applied')
+
+    # Static files are read and compressed once, requests are served from memory
+    manifest = StaticManifest(app.static_folder)
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        static_folder_path = app.static_folder
+        if static_folder_path is None:
+                return "Static folder not configured", 404
+
+        asset = manifest.get(path) if path != "" else None
+        if asset is not None:
+            return manifest.serve(asset)
+        if path != "" and manifest.on_disk_only(path):
+            return send_from_directory(static_folder_path, path)
+
+        index = manifest.get('index.html')
+        if index is not None:
+            return manifest.serve(index)
         else:
             return "EXAMIZING Backend API is running!", 200
 
+    return app
+
+app = create_app()
+
 
 if __name__ == '__main__':
+    with app.app_context():
+        migrate()
     app.run(host='0.0.0.0', port=5000, debug=True)
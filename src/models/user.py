@@ -1,10 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
 class User(db.Model):
+    # Composite indexes back the keyset pagination of list endpoints, newest first
+    __table_args__ = (db.Index('ix_user_created_at_id', 'created_at', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -15,12 +17,17 @@ class User(db.Model):
     # Relationships
     documents = db.relationship('Document', backref='user', lazy=True, cascade='all, delete-orphan')
     quiz_results = db.relationship('QuizResult', backref='user', lazy=True, cascade='all, delete-orphan')
+    token_transactions = db.relationship('TokenTransaction', lazy=True, cascade='all, delete-orphan')
+    token_reservations = db.relationship('TokenReservation', lazy=True, cascade='all, delete-orphan')
+    stats = db.relationship('UserStats', lazy=True, uselist=False, cascade='all, delete-orphan')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        from src.services.passwords import hash_password
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        from src.services.passwords import verify_password
+        return verify_password(self.password_hash, password)
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -34,18 +41,84 @@ class User(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class StoredFile(db.Model):
+    # Content-addressed upload shared by every Document with the same bytes
+    sha256 = db.Column(db.String(64), primary_key=True)
+    file_path = db.Column(db.String(500), nullable=False)
+    file_type = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=1)  # Documents pointing at this file
+    # Extracted text content, possibly only the first pages. Deferred so listings never load it
+    content_text = db.deferred(db.Column(db.Text))
+    content_preview = db.Column(db.String(500))  # First characters of the text, stored at extraction time
+    char_count = db.Column(db.Integer, default=0)
+    page_count = db.Column(db.Integer)  # Unknown until the end of the file has been reached
+    extracted_pages = db.Column(db.Integer, default=0)
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # pending, ready, failed
+    extraction_error = db.Column(db.Text)
+    extraction_started_at = db.Column(db.DateTime)  # Last resubmission of a stalled extraction, created_at before that
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PassageIndex(db.Model):
+    # BM25 index over passages of a stored file's text, zlib-compressed JSON
+    sha256 = db.Column(db.String(64), db.ForeignKey('stored_file.sha256'), primary_key=True)
+    indexed_chars = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Document(db.Model):
+    __table_args__ = (db.Index('ix_document_user_uploaded_at_id', 'user_id', 'uploaded_at', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     file_type = db.Column(db.String(50), nullable=False)
-    content_text = db.Column(db.Text)  # Extracted text content
+    file_hash = db.Column(db.String(64), db.ForeignKey('stored_file.sha256'), index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
+    blob = db.relationship('StoredFile', lazy=True)
     quizzes = db.relationship('Quiz', backref='document', lazy=True, cascade='all, delete-orphan')
+    quiz_jobs = db.relationship('QuizJob', backref='document', lazy=True, cascade='all, delete-orphan')
+    stats = db.relationship('DocumentStats', lazy=True, uselist=False, cascade='all, delete-orphan')
+
+    # Extraction state lives on the shared StoredFile
+    @property
+    def content_text(self):
+        return self.blob.content_text if self.blob else None
+
+    @property
+    def content_preview(self):
+        return self.blob.content_preview if self.blob else None
+
+    @property
+    def char_count(self):
+        return self.blob.char_count if self.blob else 0
+
+    @property
+    def status(self):
+        if self.blob:
+            return self.blob.status
+        # Uploads always get a stored file, only rows from before deduplication lack one
+        return 'failed' if self.file_hash is None else 'pending'
+
+    @property
+    def extraction_error(self):
+        if self.blob:
+            return self.blob.extraction_error
+        if self.file_hash is None:
+            return "Uploaded before content-addressed storage, run 'flask documents dedupe'"
+        return None
+
+    @property
+    def page_count(self):
+        return self.blob.page_count if self.blob else None
+
+    @property
+    def extracted_pages(self):
+        return self.blob.extracted_pages if self.blob else 0
 
     def to_dict(self):
         return {
@@ -53,10 +126,17 @@ class Document(db.Model):
             'filename': self.filename,
             'original_filename': self.original_filename,
             'file_type': self.file_type,
+            'status': self.status,
+            'extraction_error': self.extraction_error,
+            'page_count': self.page_count,
+            'extracted_pages': self.extracted_pages,
+            'char_count': self.char_count,
             'uploaded_at': self.uploaded_at.isoformat() if self.uploaded_at else None
         }
 
 class Quiz(db.Model):
+    __table_args__ = (db.Index('ix_quiz_user_created_at_id', 'user_id', 'created_at', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -68,6 +148,7 @@ class Quiz(db.Model):
     
     # Relationships
     results = db.relationship('QuizResult', backref='quiz', lazy=True, cascade='all, delete-orphan')
+    stats = db.relationship('QuizStats', lazy=True, uselist=False, cascade='all, delete-orphan')
 
     def to_dict(self):
         return {
@@ -80,9 +161,15 @@ class Quiz(db.Model):
         }
 
 class QuizResult(db.Model):
+    __table_args__ = (
+        db.Index('ix_quiz_result_user_completed_at_id', 'user_id', 'completed_at', 'id'),
+        db.Index('ix_quiz_result_quiz_completed_at_id', 'quiz_id', 'completed_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    participant = db.Column(db.String(255))  # Student name when a teacher submits answers in bulk
     score = db.Column(db.Integer, nullable=False)
     total_questions = db.Column(db.Integer, nullable=False)
     percentage = db.Column(db.Float, nullable=False)
@@ -93,9 +180,104 @@ class QuizResult(db.Model):
         return {
             'id': self.id,
             'quiz_id': self.quiz_id,
+            'participant': self.participant,
             'score': self.score,
             'total_questions': self.total_questions,
             'percentage': self.percentage,
             'completed_at': self.completed_at.isoformat() if self.completed_at else None
         }
 
+
+class QuizCacheEntry(db.Model):
+    key = db.Column(db.String(64), primary_key=True)  # SHA-256 of the generation inputs
+    questions_data = db.Column(db.Text, nullable=False)  # JSON string of questions
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class QuizJob(db.Model):
+    id = db.Column(db.String(36), primary_key=True)  # uuid4
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'))
+    question_count = db.Column(db.Integer, nullable=False)
+    custom_prompt = db.Column(db.Text)
+    reservation_id = db.Column(db.String(36), db.ForeignKey('token_reservation.id'))
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # pending, running, succeeded, failed
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'document_id': self.document_id,
+            'quiz_id': self.quiz_id,
+            'question_count': self.question_count,
+            'custom_prompt': self.custom_prompt,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class TokenTransaction(db.Model):
+    # Append-only ledger, User.tokens is the running balance it materializes
+    __table_args__ = (db.Index('ix_token_transaction_user_created_at_id', 'user_id', 'created_at', 'id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)  # Positive for credits, negative for debits
+    kind = db.Column(db.String(20), nullable=False)  # signup, purchase, debit, reserve, refund, adjustment
+    balance_after = db.Column(db.Integer, nullable=False)
+    reference = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'amount': self.amount,
+            'kind': self.kind,
+            'balance_after': self.balance_after,
+            'reference': self.reference,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class TokenReservation(db.Model):
+    id = db.Column(db.String(36), primary_key=True)  # uuid4
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    amount = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='held')  # held, committed, refunded
+    reference = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    settled_at = db.Column(db.DateTime)
+
+class AttemptStatsMixin:
+    # Running totals maintained on every QuizResult insert
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Integer, nullable=False, default=0)
+    question_sum = db.Column(db.Integer, nullable=False, default=0)
+    percentage_sum = db.Column(db.Float, nullable=False, default=0.0)
+    best_percentage = db.Column(db.Float, nullable=False, default=0.0)
+    last_attempt_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'attempts': self.attempts,
+            'total_score': self.score_sum,
+            'total_questions': self.question_sum,
+            'average_percentage': round(self.percentage_sum / self.attempts, 2) if self.attempts else 0.0,
+            'best_percentage': self.best_percentage,
+            'last_attempt_at': self.last_attempt_at.isoformat() if self.last_attempt_at else None
+        }
+
+class UserStats(AttemptStatsMixin, db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+
+class QuizStats(AttemptStatsMixin, db.Model):
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), primary_key=True)
+
+class DocumentStats(AttemptStatsMixin, db.Model):
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), primary_key=True)
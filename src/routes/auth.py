@@ -1,5 +1,10 @@
 from flask import Blueprint, request, jsonify, session
-from src.models.user import db, User
+from src.models.user import db, User, TokenTransaction
+from src.services.pagination import page_args, paginate, InvalidCursor
+from src.services.passwords import upgrade_hash, PasswordHasherBusy
+from src.services.user_cache import get_user_snapshot
+from src.services.token_ledger import credit, debit, record_transaction, ledger_balance, InsufficientTokens, UnknownUser
+import click
 import re
 
 auth_bp = Blueprint('auth', __name__)
@@ -8,6 +13,11 @@ def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+def hasher_busy_response():
+    response = jsonify({'error': 'Too many sign-in attempts in progress, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     try:
@@ -44,6 +54,8 @@ def register():
         new_user.set_password(password)
         
         db.session.add(new_user)
+        db.session.flush()
+        record_transaction(new_user.id, new_user.tokens, 'signup', new_user.tokens)
         db.session.commit()
         
         # Set session
@@ -55,6 +67,9 @@ def register():
             'user': new_user.to_dict()
         }), 201
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return hasher_busy_response()
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Registration failed: {str(e)}'}), 500
@@ -79,6 +94,10 @@ def login():
         if not user or not user.check_password(password):
             return jsonify({'error': 'Invalid email or password'}), 401
         
+        # Hashes made with an older method or cost are upgraded while the password is at hand
+        if upgrade_hash(user, password):
+            db.session.commit()
+        
         # Set session
         session['user_id'] = user.id
         session['user_email'] = user.email
@@ -88,7 +107,11 @@ def login():
             'user': user.to_dict()
         }), 200
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return hasher_busy_response()
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Login failed: {str(e)}'}), 500
 
 @auth_bp.route('/logout', methods=['POST'])
@@ -107,11 +130,13 @@ def get_current_user():
         if not user_id:
             return jsonify({'error': 'Not authenticated'}), 401
         
-        user = User.query.get(user_id)
-        if not user:
+        snapshot = get_user_snapshot(user_id)
+        if not snapshot:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify({'user': user.to_dict()}), 200
+        response = jsonify({'user': snapshot['user']})
+        response.set_etag(snapshot['etag'])
+        return response.make_conditional(request)
         
     except Exception as e:
         return jsonify({'error': f'Failed to get user info: {str(e)}'}), 500
@@ -124,11 +149,13 @@ def get_user_tokens():
         if not user_id:
             return jsonify({'error': 'Not authenticated'}), 401
         
-        user = User.query.get(user_id)
-        if not user:
+        snapshot = get_user_snapshot(user_id)
+        if not snapshot:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify({'tokens': user.tokens}), 200
+        response = jsonify({'tokens': snapshot['user']['tokens']})
+        response.set_etag(f"{snapshot['etag']}-tokens")
+        return response.make_conditional(request)
         
     except Exception as e:
         return jsonify({'error': f'Failed to get tokens: {str(e)}'}), 500
@@ -147,16 +174,14 @@ def add_tokens():
         if not isinstance(tokens_to_add, int) or tokens_to_add <= 0:
             return jsonify({'error': 'Invalid token amount'}), 400
         
-        user = User.query.get(user_id)
-        if not user:
+        try:
+            total_tokens = credit(user_id, tokens_to_add, 'purchase')
+        except UnknownUser:
             return jsonify({'error': 'User not found'}), 404
         
-        user.tokens += tokens_to_add
-        db.session.commit()
-        
         return jsonify({
             'message': f'Added {tokens_to_add} tokens',
-            'total_tokens': user.tokens
+            'total_tokens': total_tokens
         }), 200
         
     except Exception as e:
@@ -177,22 +202,63 @@ def deduct_tokens():
         if not isinstance(tokens_to_deduct, int) or tokens_to_deduct <= 0:
             return jsonify({'error': 'Invalid token amount'}), 400
         
-        user = User.query.get(user_id)
-        if not user:
+        try:
+            remaining_tokens = debit(user_id, tokens_to_deduct, 'debit')
+        except UnknownUser:
             return jsonify({'error': 'User not found'}), 404
-        
-        if user.tokens < tokens_to_deduct:
+        except InsufficientTokens:
             return jsonify({'error': 'Insufficient tokens'}), 400
         
-        user.tokens -= tokens_to_deduct
-        db.session.commit()
-        
         return jsonify({
             'message': f'Deducted {tokens_to_deduct} tokens',
-            'remaining_tokens': user.tokens
+            'remaining_tokens': remaining_tokens
         }), 200
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Failed to deduct tokens: {str(e)}'}), 500
 
+
+@auth_bp.route('/tokens/transactions', methods=['GET'])
+def get_token_transactions():
+    try:
+        user_id = session.get('user_id')
+        
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        try:
+            after, limit = page_args()
+        except InvalidCursor:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+        transactions, next_cursor = paginate(
+            TokenTransaction.query.filter_by(user_id=user_id),
+            TokenTransaction.created_at, TokenTransaction.id, after, limit
+        )
+        
+        return jsonify({
+            'transactions': [t.to_dict() for t in transactions],
+            'next_cursor': next_cursor
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to get transactions: {str(e)}'}), 500
+
+@auth_bp.cli.command('reconcile-tokens')
+@click.option('--fix', is_flag=True, help='Append adjustment entries so the ledger matches User.tokens.')
+def reconcile_tokens_command(fix):
+    """Compare every user's token balance with the sum of their ledger."""
+    mismatched = 0
+    for user_id, tokens in db.session.query(User.id, User.tokens).order_by(User.id).all():
+        difference = (tokens or 0) - ledger_balance(user_id)
+        if difference == 0:
+            continue
+        mismatched += 1
+        click.echo(f'User {user_id}: balance {tokens}, ledger off by {difference}')
+        if fix:
+            # Users created before the ledger existed get an opening entry this way
+            record_transaction(user_id, difference, 'adjustment', tokens or 0, 'reconcile')
+    if fix:
+        db.session.commit()
+    click.echo(f'{mismatched} users {"adjusted" if fix else "out of balance"}')
@@ -1,50 +1,39 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app
 from werkzeug.utils import secure_filename
-from src.models.user import db, User, Document
+from sqlalchemy import inspect
+from src.models.user import db, User, Document, StoredFile
+from src.services.extraction import extract_text, ExtractionError, submit_extraction, resubmit_stale_extraction, reprocess_blobs
+from src.services.storage import store_upload, register_file, register_text, hash_file
+from src.services.pagination import page_args, paginate, InvalidCursor
+from datetime import datetime
+import click
 import os
-import uuid
-import PyPDF2
-import docx
-from io import BytesIO
 
 documents_bp = Blueprint('documents', __name__)
 
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx'}
-
-# Create upload folder if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+UPLOAD_BATCH_MAX_FILES = int(os.getenv('UPLOAD_BATCH_MAX_FILES', '50'))
+# Request size limit of a batch upload, single uploads keep the app wide MAX_CONTENT_LENGTH
+UPLOAD_BATCH_MAX_BYTES = int(os.getenv('UPLOAD_BATCH_MAX_BYTES', str(200 * 1024 * 1024)))
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def part_size(file):
+    """Size in bytes of an uploaded part, which is already spooled to memory or a temporary file"""
+    stream = file.stream
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
 def extract_text_from_file(file_path, file_type):
     """Extract text content from uploaded files"""
     try:
-        if file_type == 'text/plain':
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        
-        elif file_type == 'application/pdf':
-            text = ""
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-            return text
-        
-        elif file_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-            doc = docx.Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
-        
-        else:
-            return "Unsupported file type for text extraction"
-    
-    except Exception as e:
-        return f"Error extracting text: {str(e)}"
+        return extract_text(file_path, file_type)
+    except ExtractionError as e:
+        return str(e)
 
 @documents_bp.route('/upload', methods=['POST'])
 def upload_document():
@@ -65,31 +54,31 @@ def upload_document():
         if not allowed_file(file.filename):
             return jsonify({'error': 'File type not allowed. Supported types: txt, pdf, doc, docx'}), 400
         
-        # Generate unique filename
         original_filename = secure_filename(file.filename)
         file_extension = original_filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
         
-        # Save file
-        file.save(file_path)
+        # Save file under its content hash, identical uploads share one copy
+        stored_file, created = store_upload(file, file.content_type, file_extension)
         
-        # Extract text content
-        content_text = extract_text_from_file(file_path, file.content_type)
-        
-        # Save document info to database
+        # Save document info to database, the text is extracted in the background
         document = Document(
             user_id=user_id,
-            filename=unique_filename,
+            filename=os.path.basename(stored_file.file_path),
             original_filename=original_filename,
-            file_path=file_path,
-            file_type=file.content_type,
-            content_text=content_text
+            file_path=stored_file.file_path,
+            file_type=stored_file.file_type,
+            file_hash=stored_file.sha256,
+            blob=stored_file
         )
         
         db.session.add(document)
         db.session.commit()
         
+        if created or stored_file.status == 'failed':
+            submit_extraction(current_app._get_current_object(), stored_file)
+        else:
+            resubmit_stale_extraction(current_app._get_current_object(), stored_file)
+        
         return jsonify({
             'message': 'Document uploaded successfully',
             'document': document.to_dict()
@@ -99,6 +88,103 @@ def upload_document():
         db.session.rollback()
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
+@documents_bp.route('/upload/batch', methods=['POST'])
+def upload_documents_batch():
+    """Upload many files in one request; every `files` part gets its own result and a bad file fails alone"""
+    try:
+        user_id = session.get('user_id')
+        
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        # Must be set before the form is parsed; parts are spooled to temporary files while parsing
+        request.max_content_length = UPLOAD_BATCH_MAX_BYTES
+        files = request.files.getlist('files')
+        
+        if not files:
+            return jsonify({'error': 'No files provided'}), 400
+        
+        if len(files) > UPLOAD_BATCH_MAX_FILES:
+            return jsonify({'error': f'Too many files, at most {UPLOAD_BATCH_MAX_FILES} per batch'}), 400
+        
+        # The batch limit is for the whole request, each file still has the single upload limit
+        max_file_bytes = current_app.config.get('MAX_CONTENT_LENGTH')
+        results = []
+        rows = []
+        to_extract = {}
+        stalled = {}  # Already pending files, resubmitted if their extraction was lost
+        uploaded_at = datetime.utcnow()
+        for file in files:
+            if not file.filename or not allowed_file(file.filename):
+                results.append({'filename': file.filename,
+                                'error': 'File type not allowed. Supported types: txt, pdf, doc, docx'})
+                continue
+            
+            if max_file_bytes and part_size(file) > max_file_bytes:
+                results.append({'filename': file.filename,
+                                'error': f'File too large, at most {max_file_bytes // (1024 * 1024)}MB per file'})
+                continue
+            
+            original_filename = secure_filename(file.filename)
+            try:
+                # A savepoint per file, so a failure only takes back that file's reference
+                with db.session.begin_nested():
+                    stored_file, created = store_upload(file, file.content_type,
+                                                        original_filename.rsplit('.', 1)[1].lower())
+            except Exception as e:
+                results.append({'filename': original_filename, 'error': f'Upload failed: {str(e)}'})
+                continue
+            
+            rows.append({
+                'user_id': user_id,
+                'filename': os.path.basename(stored_file.file_path),
+                'original_filename': original_filename,
+                'file_path': stored_file.file_path,
+                'file_type': stored_file.file_type,
+                'file_hash': stored_file.sha256,
+                'uploaded_at': uploaded_at
+            })
+            results.append({'filename': original_filename, 'document': None})
+            if created or stored_file.status == 'failed':
+                to_extract[stored_file.sha256] = stored_file
+            elif stored_file.status == 'pending':
+                stalled[stored_file.sha256] = stored_file
+        
+        # Every document row goes in with one executemany and one commit; the
+        # returned ids come back in the order of `rows`
+        document_ids = []
+        if rows:
+            document_ids = db.session.execute(
+                db.insert(Document).returning(Document.id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+        db.session.commit()
+        
+        # Distinct new files are extracted concurrently on the bounded extraction pool
+        app = current_app._get_current_object()
+        for stored_file in to_extract.values():
+            submit_extraction(app, stored_file)
+        for sha256, stored_file in stalled.items():
+            if sha256 not in to_extract:
+                resubmit_stale_extraction(app, stored_file)
+        
+        documents = {document.id: document for document in
+                     Document.query.options(db.joinedload(Document.blob)).filter(Document.id.in_(document_ids))}
+        uploaded = iter(document_ids)
+        for result in results:
+            if 'document' in result:
+                result['document'] = documents[next(uploaded)].to_dict()
+        
+        return jsonify({
+            'message': f'Uploaded {len(rows)} of {len(files)} files',
+            'uploaded': len(rows),
+            'failed': len(files) - len(rows),
+            'results': results
+        }), 201 if rows else 400
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
 @documents_bp.route('/', methods=['GET'])
 def get_user_documents():
     try:
@@ -107,10 +193,18 @@ def get_user_documents():
         if not user_id:
             return jsonify({'error': 'Not authenticated'}), 401
         
-        documents = Document.query.filter_by(user_id=user_id).order_by(Document.uploaded_at.desc()).all()
+        try:
+            after, limit = page_args()
+        except InvalidCursor:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+        # The stored file is joined for status and counts, its text stays deferred
+        query = Document.query.options(db.joinedload(Document.blob)).filter_by(user_id=user_id)
+        documents, next_cursor = paginate(query, Document.uploaded_at, Document.id, after, limit)
         
         return jsonify({
-            'documents': [doc.to_dict() for doc in documents]
+            'documents': [doc.to_dict() for doc in documents],
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
@@ -124,14 +218,16 @@ def get_document(document_id):
         if not user_id:
             return jsonify({'error': 'Not authenticated'}), 401
         
-        document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+        document = Document.query.options(db.joinedload(Document.blob)) \
+            .filter_by(id=document_id, user_id=user_id).first()
         
         if not document:
             return jsonify({'error': 'Document not found'}), 404
         
+        content_preview = document.content_preview or ''
         return jsonify({
             'document': document.to_dict(),
-            'content_preview': document.content_text[:500] + '...' if len(document.content_text) > 500 else document.content_text
+            'content_preview': content_preview + '...' if document.char_count > len(content_preview) else content_preview
         }), 200
         
     except Exception as e:
@@ -150,11 +246,7 @@ def delete_document(document_id):
         if not document:
             return jsonify({'error': 'Document not found'}), 404
         
-        # Delete file from filesystem
-        if os.path.exists(document.file_path):
-            os.remove(document.file_path)
-        
-        # Delete from database
+        # Delete from database, the file goes with the last document referencing it
         db.session.delete(document)
         db.session.commit()
         
@@ -164,3 +256,57 @@ def delete_document(document_id):
         db.session.rollback()
         return jsonify({'error': f'Failed to delete document: {str(e)}'}), 500
 
+
+@documents_bp.cli.command('reprocess')
+@click.option('--status', 'statuses', multiple=True, default=['pending', 'failed'], show_default=True,
+              help='Only reprocess files in this status (repeatable).')
+@click.option('--all', 'reprocess_all', is_flag=True, help='Reprocess every stored file.')
+@click.option('--batch-size', default=100, show_default=True)
+def reprocess_command(statuses, reprocess_all, batch_size):
+    """Re-extract text for stored files on the extraction pool."""
+    query = StoredFile.query
+    if not reprocess_all:
+        query = query.filter(StoredFile.status.in_(statuses))
+
+    last_hash = ''
+    total_ready = total_failed = 0
+    while True:
+        batch = query.filter(StoredFile.sha256 > last_hash).order_by(StoredFile.sha256).limit(batch_size).all()
+        if not batch:
+            break
+        ready, failed = reprocess_blobs(batch)
+        total_ready += ready
+        total_failed += failed
+        last_hash = batch[-1].sha256
+        click.echo(f'Processed {len(batch)} files: {ready} ready, {failed} failed')
+
+    click.echo(f'Done: {total_ready} ready, {total_failed} failed')
+
+@documents_bp.cli.command('dedupe')
+def dedupe_command():
+    """Move documents uploaded before deduplication into content-addressed storage."""
+    # Text extracted before stored files existed is still in the old document column
+    legacy_text = 'content_text' in {column['name'] for column in inspect(db.engine).get_columns('document')}
+    moved = recovered = missing = 0
+    for document in Document.query.filter(Document.file_hash.is_(None)).order_by(Document.id).all():
+        if os.path.exists(document.file_path):
+            extension = document.filename.rsplit('.', 1)[-1].lower()
+            stored_file, _ = register_file(document.file_path, hash_file(document.file_path),
+                                           os.path.getsize(document.file_path), document.file_type, extension)
+            moved += 1
+        else:
+            text = db.session.execute(db.text('SELECT content_text FROM document WHERE id = :id'),
+                                      {'id': document.id}).scalar() if legacy_text else None
+            if not text:
+                missing += 1
+                click.echo(f'Document {document.id}: file {document.file_path} is missing and no text was stored, skipped')
+                continue
+            stored_file, _ = register_text(text, document.file_path, document.file_type)
+            recovered += 1
+        document.file_hash = stored_file.sha256
+        document.file_path = stored_file.file_path
+        document.filename = os.path.basename(stored_file.file_path)
+        db.session.commit()
+
+    click.echo(f'Done: {moved} documents moved, {recovered} rebuilt from stored text, {missing} missing files')
+    click.echo("Run 'flask documents reprocess' to extract text for the new stored files")
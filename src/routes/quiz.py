@@ -1,22 +1,199 @@
-from flask import Blueprint, request, jsonify, session
-from src.models.user import db, User, Document, Quiz, QuizResult
+from flask import Blueprint, Response, current_app, request, jsonify, session, stream_with_context
+from src.models.user import db, User, Document, Quiz, QuizResult, QuizJob
+from src.services.quiz_cache import quiz_cache, make_cache_key
+from src.services.quiz_jobs import enqueue_quiz_job, fail_stale_jobs
+from src.services.extraction import ensure_text, resubmit_stale_extraction
+from src.services.passages import select_passages
+from src.services.extractive import generate_extractive_questions
+from src.services.grading import (
+    load_quiz_for_grading, normalize_answers, grade, grade_sheets, InvalidSubmission
+)
+from src.services.stats import record_results
+from src.services.pagination import page_args, paginate, InvalidCursor
+from src.services.user_cache import get_user_snapshot
+from src.services.metrics import LLM_LATENCY, timed, record_llm_usage, record_fallback
+from src.services.llm_gateway import llm_gateway, LLM_TIMEOUT, LLM_MAX_RETRIES
+from src.services.token_ledger import reserve, commit_reservation, refund_reservation, InsufficientTokens
+from src.services.quiz_pipeline import (
+    split_into_chunks, plan_chunks, merge_questions, renumber,
+    is_valid_question, question_key, QuestionStreamParser
+)
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import json
-from openai import OpenAI
+import queue
 import os
+import threading
 
 quiz_bp = Blueprint('quiz', __name__)
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# OpenAI client, created on first use so importing this module stays cheap
+client = None
+_client_lock = threading.Lock()
+_ssl_context = None
+
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+OPENAI_TEMPERATURE = float(os.getenv('OPENAI_TEMPERATURE', '0.7'))
+CONTENT_CHAR_LIMIT = 4000  # Characters of document text sent to the model per call
+QUESTIONS_PER_CHUNK = int(os.getenv('QUIZ_QUESTIONS_PER_CHUNK', '5'))
+GENERATION_PARALLELISM = int(os.getenv('QUIZ_GENERATION_PARALLELISM', '8'))
+# thread: one pool thread per chunk on the shared client, async: chunk requests share one
+# event loop and a client of their own per generation (no connection reuse across generations)
+QUIZ_GENERATION_CLIENT = os.getenv('QUIZ_GENERATION_CLIENT', 'thread')
+# ai: the model, fast: extractive questions built locally, instantly and free of charge
+GENERATION_MODES = ('ai', 'fast')
+# Characters of a document made available to generation, extracted on demand
+SOURCE_CHAR_BUDGET = int(os.getenv('QUIZ_SOURCE_CHARS', '200000'))
+
+def get_openai_client():
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from openai import OpenAI
+                client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
+    return client
+
+def make_async_openai_client():
+    # httpx async clients are bound to the event loop, so each generation gets its own.
+    # Loading the CA bundle costs tens of milliseconds of CPU, so the SSL context is shared
+    global _ssl_context
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    if _ssl_context is None:
+        with _client_lock:
+            if _ssl_context is None:
+                import certifi
+                import ssl
+                _ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                       http_client=DefaultAsyncHttpxClient(verify=_ssl_context))
+
+def load_source_text(document, question_count, custom_prompt=""):
+    """Document text to generate from, narrowed to the passages matching a custom prompt"""
+    content_text = ensure_text(document, SOURCE_CHAR_BUDGET)
+    if custom_prompt and content_text:
+        # Enough relevant text for every chunk request of the generation plan
+        budget = -(-question_count // QUESTIONS_PER_CHUNK) * CONTENT_CHAR_LIMIT
+        relevant_text = select_passages(document.blob, custom_prompt, budget)
+        if relevant_text:
+            return relevant_text
+    return content_text
+
+class QuizGenerationError(Exception):
+    """Raised when the model call or its response parsing fails"""
+    pass
 
 def generate_quiz_questions(content_text, question_count, custom_prompt=""):
-    """Generate quiz questions using OpenAI API"""
+    """Generate quiz questions, serving repeated requests from the quiz cache"""
+    return run_quiz_generation(content_text, question_count, custom_prompt)[0]
+
+def run_quiz_generation(content_text, question_count, custom_prompt=""):
+    """Generate quiz questions and report how many of them came from the model.
+
+    Returns (questions, from_model); the remaining questions were filled in by
+    the fallback and are not charged for.
+    """
+    cache_key = make_cache_key(content_text, question_count,
+                               custom_prompt, OPENAI_MODEL, OPENAI_TEMPERATURE)
+    questions = quiz_cache.get(cache_key)
+    if questions is not None:
+        return questions, len(questions)
+
+    # End the read transaction so the pooled connection is not held for the
+    # seconds the model takes; with hundreds of requests in flight the pool runs dry
+    db.session.commit()
+
     try:
-        base_prompt = f"""
+        if QUIZ_GENERATION_CLIENT == 'async':
+            questions = asyncio.run(request_chunked_quiz_questions_async(content_text, question_count, custom_prompt))
+        else:
+            questions = request_chunked_quiz_questions(content_text, question_count, custom_prompt)
+    except QuizGenerationError as e:
+        print(str(e))
+        record_fallback('complete', question_count, question_count)
+        return generate_fallback_questions(content_text, question_count, custom_prompt), 0
+
+    if len(questions) < question_count:
+        # Some chunks failed; top up so the quiz still has the size that was paid for
+        record_fallback('complete', question_count - len(questions), question_count)
+        padding = generate_fallback_questions(content_text, question_count - len(questions), custom_prompt)
+        return renumber(questions + padding), len(questions)
+
+    # Only complete real completions are cached, never the mock fallback
+    quiz_cache.set(cache_key, questions)
+    return questions, len(questions)
+
+def request_chunked_quiz_questions(content_text, question_count, custom_prompt=""):
+    """Spread the question count over chunks of the whole document and generate them concurrently"""
+    plan = plan_chunks(split_into_chunks(content_text, CONTENT_CHAR_LIMIT), question_count, QUESTIONS_PER_CHUNK)
+    if len(plan) <= 1:
+        return merge_questions([request_quiz_questions(content_text, question_count, custom_prompt)], question_count)
+
+    batches = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=min(GENERATION_PARALLELISM, len(plan))) as executor:
+        futures = [executor.submit(request_quiz_questions, chunk, count, custom_prompt) for chunk, count in plan]
+        # Collected in submission order so questions follow the document
+        for future in futures:
+            try:
+                batches.append(future.result())
+            except QuizGenerationError as e:
+                errors.append(str(e))
+
+    if not batches:
+        raise QuizGenerationError(f"All {len(plan)} chunk requests failed: {errors[0]}")
+    for error in errors:
+        print(f"Chunk generation error: {error}")
+    return merge_questions(batches, question_count)
+
+async def request_chunked_quiz_questions_async(content_text, question_count, custom_prompt=""):
+    """Same as request_chunked_quiz_questions, with the chunk requests awaited concurrently on one event loop"""
+    plan = plan_chunks(split_into_chunks(content_text, CONTENT_CHAR_LIMIT), question_count, QUESTIONS_PER_CHUNK)
+    try:
+        client = make_async_openai_client()
+    except Exception as e:
+        # e.g. no API key configured; the caller falls back like for any failed call
+        raise QuizGenerationError(f"OpenAI API error: {str(e)}")
+    try:
+        if len(plan) <= 1:
+            batch = await request_quiz_questions_async(client, content_text, question_count, custom_prompt)
+            return merge_questions([batch], question_count)
+
+        parallelism = asyncio.Semaphore(GENERATION_PARALLELISM)
+
+        async def request_chunk(chunk, count):
+            async with parallelism:
+                return await request_quiz_questions_async(client, chunk, count, custom_prompt)
+
+        # Results keep submission order so questions follow the document
+        results = await asyncio.gather(*(request_chunk(chunk, count) for chunk, count in plan),
+                                       return_exceptions=True)
+    finally:
+        await client.close()
+
+    batches = []
+    errors = []
+    for result in results:
+        if isinstance(result, QuizGenerationError):
+            errors.append(str(result))
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            batches.append(result)
+
+    if not batches:
+        raise QuizGenerationError(f"All {len(plan)} chunk requests failed: {errors[0]}")
+    for error in errors:
+        print(f"Chunk generation error: {error}")
+    return merge_questions(batches, question_count)
+
+def build_completion_request(content_text, question_count, custom_prompt=""):
+    """Build the chat completion arguments for one batch of questions"""
+    base_prompt = f"""
         Based on the following document content, generate exactly {question_count} multiple-choice questions.
         
         Document content:
-        {content_text[:4000]}
+        {(content_text or '')[:CONTENT_CHAR_LIMIT]}
         
         {f"Additional instructions: {custom_prompt}" if custom_prompt else ""}
         
@@ -40,31 +217,110 @@ def generate_quiz_questions(content_text, question_count, custom_prompt=""):
         }}
         """
 
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert quiz generator. Generate high-quality multiple-choice questions based on document content."},
-                {"role": "user", "content": base_prompt}
-            ],
-            max_tokens=2000,
-            temperature=0.7
-        )
+    return dict(
+        model=OPENAI_MODEL,
+        messages=[
+            {"role": "system", "content": "You are an expert quiz generator. Generate high-quality multiple-choice questions based on document content."},
+            {"role": "user", "content": base_prompt}
+        ],
+        # Roughly 150 tokens per question plus the JSON envelope
+        max_tokens=min(2000, 150 * question_count + 200),
+        temperature=OPENAI_TEMPERATURE
+    )
+
+def request_quiz_questions(content_text, question_count, custom_prompt=""):
+    """Generate quiz questions using OpenAI API"""
+    try:
+        with timed(LLM_LATENCY, mode='complete'):
+            response = llm_gateway.call(
+                get_openai_client().chat.completions.create,
+                **build_completion_request(content_text, question_count, custom_prompt)
+            )
+        record_llm_usage(response.usage)
+        return parse_completion(response)
+
+    except QuizGenerationError:
+        raise
+    except Exception as e:
+        raise QuizGenerationError(f"OpenAI API error: {str(e)}")
 
-        response_text = response.choices[0].message.content
+async def request_quiz_questions_async(client, content_text, question_count, custom_prompt=""):
+    """Generate quiz questions with an AsyncOpenAI client"""
+    try:
+        with timed(LLM_LATENCY, mode='complete'):
+            response = await llm_gateway.acall(
+                client.chat.completions.create,
+                **build_completion_request(content_text, question_count, custom_prompt)
+            )
+        record_llm_usage(response.usage)
+        return parse_completion(response)
+
+    except QuizGenerationError:
+        raise
+    except Exception as e:
+        raise QuizGenerationError(f"OpenAI API error: {str(e)}")
 
+def parse_completion(response):
+    """Extract the questions list from the JSON object in a completion"""
+    response_text = response.choices[0].message.content
+
+    try:
+        start_idx = response_text.find('{')
+        end_idx = response_text.rfind('}') + 1
+        json_str = response_text[start_idx:end_idx]
+        quiz_data = json.loads(json_str)
+        return quiz_data['questions']
+    except Exception as e:
+        raise QuizGenerationError(f"JSON parsing error: {str(e)}")
+
+def stream_quiz_questions(content_text, question_count, custom_prompt=""):
+    """Yield questions as soon as each one is parsed from concurrent streamed completions"""
+    plan = plan_chunks(split_into_chunks(content_text, CONTENT_CHAR_LIMIT), question_count, QUESTIONS_PER_CHUNK)
+    if not plan:
+        plan = [(content_text, question_count)]
+
+    events = queue.Queue()
+
+    def stream_chunk(chunk, count):
         try:
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}') + 1
-            json_str = response_text[start_idx:end_idx]
-            quiz_data = json.loads(json_str)
-            return quiz_data['questions']
+            parser = QuestionStreamParser()
+            with timed(LLM_LATENCY, mode='stream'):
+                stream = llm_gateway.stream(
+                    get_openai_client().chat.completions.create,
+                    stream=True, stream_options={'include_usage': True},
+                    **build_completion_request(chunk, count, custom_prompt)
+                )
+                for event in stream:
+                    # The final event carries usage and no choices
+                    record_llm_usage(getattr(event, 'usage', None))
+                    if not event.choices:
+                        continue
+                    delta = event.choices[0].delta.content
+                    if delta:
+                        for question in parser.feed(delta):
+                            events.put(('question', question))
         except Exception as e:
-            print(f"JSON parsing error: {str(e)}")
-            return generate_mock_questions(question_count, custom_prompt)
+            events.put(('error', f"OpenAI API error: {str(e)}"))
+        finally:
+            events.put(('done', None))
 
-    except Exception as e:
-        print(f"OpenAI API error: {str(e)}")
-        return generate_mock_questions(question_count, custom_prompt)
+    executor = ThreadPoolExecutor(max_workers=min(GENERATION_PARALLELISM, len(plan)))
+    try:
+        for chunk, count in plan:
+            executor.submit(stream_chunk, chunk, count)
+
+        remaining = len(plan)
+        while remaining:
+            kind, payload = events.get()
+            if kind == 'done':
+                remaining -= 1
+            elif kind == 'error':
+                print(payload)
+            else:
+                yield payload
+    finally:
+        # The client may disconnect before every chunk has finished
+        executor.shutdown(wait=False, cancel_futures=True)
 
 def generate_mock_questions(question_count, custom_prompt=""):
     questions = []
@@ -83,6 +339,82 @@ def generate_mock_questions(question_count, custom_prompt=""):
         })
     return questions
 
+def generate_fallback_questions(content_text, question_count, custom_prompt=""):
+    """Questions made from the document without the model, placeholders only when the text runs out"""
+    questions = generate_extractive_questions(content_text, question_count, custom_prompt)
+    if len(questions) < question_count:
+        questions += generate_mock_questions(question_count - len(questions), custom_prompt)
+    return renumber(questions)
+
+def load_generation_request(user_id, data, require_tokens=True):
+    """Validate a generation request body.
+
+    Returns (error_response, user, document, question_count, custom_prompt).
+    """
+    document_id = data.get('document_id')
+    question_count = data.get('question_count', 10)
+    custom_prompt = data.get('custom_prompt', '')
+
+    if not document_id:
+        return (jsonify({'error': 'Document ID is required'}), 400), None, None, None, None
+
+    if question_count not in [10, 20, 30, 40, 50]:
+        return (jsonify({'error': 'Invalid question count. Must be 10, 20, 30, 40, or 50'}), 400), None, None, None, None
+
+    user = User.query.get(user_id)
+    if not user:
+        return (jsonify({'error': 'User not found'}), 404), None, None, None, None
+
+    if require_tokens and user.tokens < question_count:
+        return (jsonify({'error': 'Insufficient tokens'}), 400), None, None, None, None
+
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return (jsonify({'error': 'Document not found'}), 404), None, None, None, None
+
+    if document.status == 'pending':
+        # A lost extraction is started again, the client retries like for any pending document
+        resubmit_stale_extraction(current_app._get_current_object(), document.blob)
+        return (jsonify({'error': 'Document text is still being extracted, try again shortly'}), 409), None, None, None, None
+
+    if document.status == 'failed':
+        return (jsonify({'error': f'Document text extraction failed: {document.extraction_error}'}), 422), None, None, None, None
+
+    return None, user, document, question_count, custom_prompt
+
+def too_many_generations_response():
+    response = jsonify({'error': 'Too many quiz generations in progress, wait for one to finish'})
+    response.headers['Retry-After'] = '5'
+    return response, 429
+
+def generate_fast_quiz(user, document, question_count, custom_prompt):
+    """Save and return an extractive quiz; no model call, so no tokens are charged"""
+    # Only the text extracted so far: fast mode never waits on further extraction,
+    # and the custom prompt already steers which sentences are picked
+    questions = generate_extractive_questions(document.content_text, question_count, custom_prompt)
+    if len(questions) < question_count:
+        return jsonify({'error': f'Document text is too short for {question_count} fast questions, '
+                                 f'{len(questions)} could be made'}), 422
+
+    quiz = Quiz(
+        document_id=document.id,
+        user_id=user.id,
+        title=f"Quiz for {document.original_filename}",
+        custom_prompt=custom_prompt,
+        question_count=question_count,
+        questions_data=json.dumps(questions)
+    )
+    db.session.add(quiz)
+    db.session.commit()
+
+    return jsonify({
+        'message': 'Quiz generated successfully',
+        'quiz_id': quiz.id,
+        'questions': questions,
+        'remaining_tokens': user.tokens,
+        'mode': 'fast'
+    }), 201
+
 @quiz_bp.route('/generate', methods=['POST'])
 def generate_quiz():
     try:
@@ -91,50 +423,443 @@ def generate_quiz():
             return jsonify({'error': 'Not authenticated'}), 401
 
         data = request.get_json()
-        document_id = data.get('document_id')
-        question_count = data.get('question_count', 10)
-        custom_prompt = data.get('custom_prompt', '')
+        mode = data.get('mode', 'ai')
+        if mode not in GENERATION_MODES:
+            return jsonify({'error': 'Invalid mode. Must be ai or fast'}), 400
+
+        error, user, document, question_count, custom_prompt = load_generation_request(
+            user_id, data, require_tokens=mode == 'ai')
+        if error:
+            return error
+        document_id = document.id
+        if mode == 'fast':
+            return generate_fast_quiz(user, document, question_count, custom_prompt)
+        run_async = bool(data.get('async', False))
+
+        # Queued jobs are bounded by the job pool, requests waiting on the model by a per-user limit
+        if not run_async and not llm_gateway.try_acquire_user(user_id):
+            return too_many_generations_response()
+
+        try:
+            try:
+                # Held now, kept once the quiz is saved and refunded if generation fails
+                reservation, remaining_tokens = reserve(user_id, question_count, reference=f'document:{document_id}')
+            except InsufficientTokens:
+                return jsonify({'error': 'Insufficient tokens'}), 400
+
+            if run_async:
+                job = enqueue_quiz_job(user_id, document_id, question_count, custom_prompt, reservation.id)
+                return jsonify({
+                    'message': 'Quiz generation queued',
+                    'job_id': job.id,
+                    'status': job.status,
+                    'status_url': f'/api/quiz/jobs/{job.id}',
+                    'remaining_tokens': remaining_tokens
+                }), 202
+
+            try:
+                content_text = load_source_text(document, question_count, custom_prompt)
+                questions, from_model = run_quiz_generation(content_text, question_count, custom_prompt)
+
+                quiz = Quiz(
+                    document_id=document_id,
+                    user_id=user_id,
+                    title=f"Quiz for {document.original_filename}",
+                    custom_prompt=custom_prompt,
+                    question_count=question_count,
+                    questions_data=json.dumps(questions)
+                )
+
+                db.session.add(quiz)
+                db.session.flush()
+                tokens_refunded = 0
+                if from_model:
+                    # Only questions the model wrote are charged, the rest of the hold goes back;
+                    # None when the hold was already settled elsewhere
+                    tokens_refunded = commit_reservation(reservation.id, reference=f'quiz:{quiz.id}', amount=from_model) or 0
+                    remaining_tokens += tokens_refunded
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                refund_reservation(reservation.id)
+                raise
+
+            if not from_model:
+                # The model failed, fallback questions are free
+                remaining_tokens = refund_reservation(reservation.id)
+                tokens_refunded = question_count
+
+            return jsonify({
+                'message': 'Quiz generated successfully',
+                'quiz_id': quiz.id,
+                'questions': questions,
+                'remaining_tokens': remaining_tokens,
+                'tokens_refunded': tokens_refunded
+            }), 201
+        finally:
+            if not run_async:
+                llm_gateway.release_user(user_id)
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Quiz generation failed: {str(e)}'}), 500
+
+@quiz_bp.route('/generate/stream', methods=['POST'])
+def generate_quiz_stream():
+    """Stream questions as NDJSON (default) or Server-Sent Events while they are generated"""
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        data = request.get_json()
+        error, user, document, question_count, custom_prompt = load_generation_request(user_id, data)
+        if error:
+            return error
+
+        stream_format = data.get('format') or request.args.get('format')
+        if not stream_format:
+            stream_format = 'sse' if 'text/event-stream' in request.headers.get('Accept', '') else 'ndjson'
+        if stream_format not in ('ndjson', 'sse'):
+            return jsonify({'error': 'Invalid format. Must be ndjson or sse'}), 400
 
-        if not document_id:
-            return jsonify({'error': 'Document ID is required'}), 400
+        document_id = document.id
+        title = f"Quiz for {document.original_filename}"
+        content_text = load_source_text(document, question_count, custom_prompt)
 
-        if question_count not in [10, 20, 30, 40, 50]:
-            return jsonify({'error': 'Invalid question count. Must be 10, 20, 30, 40, or 50'}), 400
+        def encode(event_type, payload):
+            if stream_format == 'sse':
+                return f"event: {event_type}\ndata: {json.dumps(payload)}\n\n"
+            return json.dumps({'type': event_type, **payload}) + "\n"
 
-        user = User.query.get(user_id)
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
+        # The user's generation slot is held until the stream ends
+        if not llm_gateway.try_acquire_user(user_id):
+            return too_many_generations_response()
 
-        if user.tokens < question_count:
+        try:
+            reservation, remaining_tokens = reserve(user_id, question_count, reference=f'document:{document_id}')
+        except InsufficientTokens:
+            llm_gateway.release_user(user_id)
             return jsonify({'error': 'Insufficient tokens'}), 400
+        except Exception:
+            llm_gateway.release_user(user_id)
+            raise
+
+        def generate():
+            settled = False
+            try:
+                settled = yield from stream_and_save()
+            finally:
+                llm_gateway.release_user(user_id)
+                if not settled:
+                    # Failed or the client went away before the quiz was saved
+                    refund_reservation(reservation.id)
+
+        def stream_and_save():
+            from_model = 0
+            cache_key = make_cache_key(content_text, question_count,
+                                       custom_prompt, OPENAI_MODEL, OPENAI_TEMPERATURE)
+            cached = quiz_cache.get(cache_key)
+            questions = []
+            seen = set()
+
+            if cached is not None:
+                questions = cached
+                from_model = len(questions)
+                for question in questions:
+                    yield encode('question', {'question': question})
+            else:
+                stream = stream_quiz_questions(content_text, question_count, custom_prompt)
+                try:
+                    for question in stream:
+                        key = question_key(question) if is_valid_question(question) else None
+                        if key is None or key in seen:
+                            continue
+                        seen.add(key)
+                        question['id'] = len(questions) + 1
+                        questions.append(question)
+                        yield encode('question', {'question': question})
+                        if len(questions) == question_count:
+                            break
+                finally:
+                    stream.close()
+
+                from_model = len(questions)
+                if len(questions) == question_count:
+                    quiz_cache.set(cache_key, questions)
+                else:
+                    record_fallback('stream', question_count - len(questions), question_count)
+                    padding = renumber(generate_fallback_questions(content_text, question_count - len(questions), custom_prompt),
+                                       start=len(questions) + 1)
+                    for question in padding:
+                        yield encode('question', {'question': question})
+                    questions.extend(padding)
+
+            try:
+                quiz = Quiz(
+                    document_id=document_id,
+                    user_id=user_id,
+                    title=title,
+                    custom_prompt=custom_prompt,
+                    question_count=question_count,
+                    questions_data=json.dumps(questions)
+                )
+                db.session.add(quiz)
+                db.session.flush()
+                tokens_refunded = 0
+                if from_model:
+                    tokens_refunded = commit_reservation(reservation.id, reference=f'quiz:{quiz.id}', amount=from_model) or 0
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                yield encode('error', {'error': f'Quiz generation failed: {str(e)}'})
+                return False
 
-        document = Document.query.filter_by(id=document_id, user_id=user_id).first()
-        if not document:
-            return jsonify({'error': 'Document not found'}), 404
+            balance = remaining_tokens + tokens_refunded
+            if not from_model:
+                # The model failed, fallback questions are free
+                balance = refund_reservation(reservation.id)
+                tokens_refunded = question_count
 
-        questions = generate_quiz_questions(document.content_text, question_count, custom_prompt)
+            yield encode('done', {
+                'message': 'Quiz generated successfully',
+                'quiz_id': quiz.id,
+                'remaining_tokens': balance,
+                'tokens_refunded': tokens_refunded
+            })
+            return True
+
+        mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+        return Response(stream_with_context(generate()), mimetype=mimetype,
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Quiz generation failed: {str(e)}'}), 500
 
-        user.tokens -= question_count
+MAX_BATCH_SUBMISSIONS = 1000
 
-        quiz = Quiz(
-            document_id=document_id,
+@quiz_bp.route('/<int:quiz_id>/submit', methods=['POST'])
+def submit_quiz(quiz_id):
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        quiz, answer_key = load_quiz_for_grading(quiz_id, user_id)
+        if not quiz:
+            return jsonify({'error': 'Quiz not found'}), 404
+
+        try:
+            answers = normalize_answers(data.get('answers'), len(answer_key))
+        except InvalidSubmission as e:
+            return jsonify({'error': str(e)}), 400
+
+        score = grade(answer_key, answers)
+        result = QuizResult(
+            quiz_id=quiz.id,
             user_id=user_id,
-            title=f"Quiz for {document.original_filename}",
-            custom_prompt=custom_prompt,
-            question_count=question_count,
-            questions_data=json.dumps(questions)
+            participant=data.get('participant'),
+            score=score,
+            total_questions=len(answer_key),
+            percentage=round(score * 100.0 / len(answer_key), 2) if answer_key else 0.0,
+            answers_data=json.dumps(answers)
         )
+        db.session.add(result)
+        db.session.flush()
+        record_results(quiz, [{
+            'user_id': user_id,
+            'score': result.score,
+            'total_questions': result.total_questions,
+            'percentage': result.percentage,
+            'completed_at': result.completed_at
+        }])
+        db.session.commit()
+
+        return jsonify({
+            'message': 'Quiz submitted successfully',
+            'result': result.to_dict(),
+            'correct': [answer == correct for answer, correct in zip(answers, answer_key)],
+            'correct_answers': list(answer_key)
+        }), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Quiz submission failed: {str(e)}'}), 500
+
+@quiz_bp.route('/<int:quiz_id>/submit/batch', methods=['POST'])
+def submit_quiz_batch(quiz_id):
+    """Grade a whole class's answer sheets in one request and one transaction"""
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        data = request.get_json()
+        submissions = (data or {}).get('submissions')
+        if not isinstance(submissions, list) or not submissions:
+            return jsonify({'error': 'submissions must be a non-empty list'}), 400
+
+        if len(submissions) > MAX_BATCH_SUBMISSIONS:
+            return jsonify({'error': f'At most {MAX_BATCH_SUBMISSIONS} submissions per batch'}), 400
+
+        quiz, answer_key = load_quiz_for_grading(quiz_id, user_id)
+        if not quiz:
+            return jsonify({'error': 'Quiz not found'}), 404
 
-        db.session.add(quiz)
+        sheets = []
+        for i, submission in enumerate(submissions):
+            if not isinstance(submission, dict):
+                return jsonify({'error': f'Submission {i}: must be an object'}), 400
+            try:
+                answers = normalize_answers(submission.get('answers'), len(answer_key))
+            except InvalidSubmission as e:
+                return jsonify({'error': f'Submission {i}: {str(e)}'}), 400
+            sheets.append((submission.get('participant'), answers))
+
+        rows = grade_sheets(quiz, answer_key, user_id, sheets)
+        record_results(quiz, rows)
         db.session.commit()
 
+        percentages = [row['percentage'] for row in rows]
         return jsonify({
-            'message': 'Quiz generated successfully',
-            'quiz_id': quiz.id,
-            'questions': questions,
-            'remaining_tokens': user.tokens
+            'message': f'Graded {len(rows)} submissions',
+            'results': [{
+                'participant': row['participant'],
+                'score': row['score'],
+                'total_questions': row['total_questions'],
+                'percentage': row['percentage']
+            } for row in rows],
+            'average_percentage': round(sum(percentages) / len(percentages), 2)
         }), 201
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': f'Quiz generation failed: {str(e)}'}), 500
+        return jsonify({'error': f'Batch submission failed: {str(e)}'}), 500
+
+@quiz_bp.route('/', methods=['GET'])
+def get_user_quizzes():
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        try:
+            after, limit = page_args()
+        except InvalidCursor:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+        query = Quiz.query.options(db.defer(Quiz.questions_data)).filter_by(user_id=user_id)
+        quizzes, next_cursor = paginate(query, Quiz.created_at, Quiz.id, after, limit)
+
+        return jsonify({
+            'quizzes': [quiz.to_dict() for quiz in quizzes],
+            'next_cursor': next_cursor
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to get quizzes: {str(e)}'}), 500
+
+@quiz_bp.route('/results', methods=['GET'])
+def get_user_results():
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        try:
+            after, limit = page_args()
+        except InvalidCursor:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+        query = QuizResult.query.options(db.defer(QuizResult.answers_data)).filter_by(user_id=user_id)
+        results, next_cursor = paginate(query, QuizResult.completed_at, QuizResult.id, after, limit)
+
+        return jsonify({
+            'results': [result.to_dict() for result in results],
+            'next_cursor': next_cursor
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to get results: {str(e)}'}), 500
+
+@quiz_bp.route('/<int:quiz_id>/results', methods=['GET'])
+def get_quiz_results(quiz_id):
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        if not db.session.query(Quiz.id).filter_by(id=quiz_id, user_id=user_id).first():
+            return jsonify({'error': 'Quiz not found'}), 404
+
+        try:
+            after, limit = page_args()
+        except InvalidCursor:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+        query = QuizResult.query.options(db.defer(QuizResult.answers_data)).filter_by(quiz_id=quiz_id)
+        results, next_cursor = paginate(query, QuizResult.completed_at, QuizResult.id, after, limit)
+
+        return jsonify({
+            'quiz_id': quiz_id,
+            'results': [result.to_dict() for result in results],
+            'next_cursor': next_cursor
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to get results: {str(e)}'}), 500
+
+@quiz_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_quiz_job(job_id):
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        job = QuizJob.query.filter_by(id=job_id, user_id=user_id).first()
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        if job.status == 'running' and fail_stale_jobs(job.id):
+            # Its worker died, the job is failed and its tokens refunded
+            db.session.refresh(job)
+
+        response = {'job': job.to_dict()}
+        if job.status == 'succeeded' and job.quiz_id:
+            quiz = db.session.get(Quiz, job.quiz_id)
+            if quiz:
+                response['questions'] = json.loads(quiz.questions_data)
+                response['remaining_tokens'] = get_user_snapshot(user_id)['user']['tokens']
+
+        return jsonify(response), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to get job: {str(e)}'}), 500
+
+@quiz_bp.route('/llm/status', methods=['GET'])
+def get_llm_status():
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        return jsonify({'llm': llm_gateway.state()}), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to get LLM status: {str(e)}'}), 500
+
+@quiz_bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        return jsonify({'cache': quiz_cache.stats()}), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to get cache stats: {str(e)}'}), 500
@@ -0,0 +1,54 @@
+from flask import Blueprint, request, jsonify, session
+from src.services.pagination import offset_page_args, encode_offset_cursor, InvalidCursor
+from src.services.search import search_documents, search_quizzes, rebuild_search_index, InvalidSearchQuery
+import click
+
+search_bp = Blueprint('search', __name__)
+
+def search_response(search, key):
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Search query is required'}), 400
+
+    try:
+        offset, limit = offset_page_args()
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    try:
+        results, has_more = search(user_id, query, offset, limit)
+    except InvalidSearchQuery:
+        return jsonify({'error': 'Search query has no searchable words'}), 400
+
+    return jsonify({
+        key: [dict(item.to_dict(), snippet=snippet, score=score) for item, snippet, score in results],
+        'next_cursor': encode_offset_cursor(offset + limit) if has_more else None
+    }), 200
+
+@search_bp.route('/documents', methods=['GET'])
+def search_user_documents():
+    """Full-text search over the text of the user's documents, best match first"""
+    try:
+        return search_response(search_documents, 'documents')
+    except Exception as e:
+        return jsonify({'error': f'Search failed: {str(e)}'}), 500
+
+@search_bp.route('/quizzes', methods=['GET'])
+def search_user_quizzes():
+    """Full-text search over the titles, prompts and questions of the user's quizzes"""
+    try:
+        return search_response(search_quizzes, 'quizzes')
+    except Exception as e:
+        return jsonify({'error': f'Search failed: {str(e)}'}), 500
+
+@search_bp.cli.command('rebuild')
+def rebuild_command():
+    """Refill the full-text search index from all documents and quizzes."""
+    if rebuild_search_index():
+        click.echo('Rebuilt the search index')
+    else:
+        click.echo('The search index is maintained by the database, nothing to rebuild')
@@ -0,0 +1,67 @@
+from flask import Blueprint, jsonify, session
+from src.models.user import db, Document, Quiz, UserStats, QuizStats, DocumentStats
+from src.services.stats import rebuild_stats
+import click
+
+stats_bp = Blueprint('stats', __name__)
+
+EMPTY_STATS = {
+    'attempts': 0,
+    'total_score': 0,
+    'total_questions': 0,
+    'average_percentage': 0.0,
+    'best_percentage': 0.0,
+    'last_attempt_at': None
+}
+
+@stats_bp.route('/me', methods=['GET'])
+def get_my_stats():
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        stats = db.session.get(UserStats, user_id)
+        return jsonify({'stats': stats.to_dict() if stats else EMPTY_STATS}), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to get stats: {str(e)}'}), 500
+
+@stats_bp.route('/quizzes/<int:quiz_id>', methods=['GET'])
+def get_quiz_stats(quiz_id):
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        if not db.session.query(Quiz.id).filter_by(id=quiz_id, user_id=user_id).first():
+            return jsonify({'error': 'Quiz not found'}), 404
+
+        stats = db.session.get(QuizStats, quiz_id)
+        return jsonify({'quiz_id': quiz_id, 'stats': stats.to_dict() if stats else EMPTY_STATS}), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to get stats: {str(e)}'}), 500
+
+@stats_bp.route('/documents/<int:document_id>', methods=['GET'])
+def get_document_stats(document_id):
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+
+        if not db.session.query(Document.id).filter_by(id=document_id, user_id=user_id).first():
+            return jsonify({'error': 'Document not found'}), 404
+
+        stats = db.session.get(DocumentStats, document_id)
+        return jsonify({'document_id': document_id, 'stats': stats.to_dict() if stats else EMPTY_STATS}), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to get stats: {str(e)}'}), 500
+
+@stats_bp.cli.command('rebuild')
+def rebuild_command():
+    """Recompute the user, quiz and document statistics from all quiz results."""
+    rebuild_stats()
+    click.echo(f'Rebuilt stats for {UserStats.query.count()} users, {QuizStats.query.count()} quizzes '
+               f'and {DocumentStats.query.count()} documents')
@@ -1,12 +1,22 @@
 from flask import Blueprint, jsonify, request
 from src.models.user import User, db
+from src.services.pagination import page_args, paginate, InvalidCursor
 
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/users', methods=['GET'])
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    try:
+        after, limit = page_args()
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    users, next_cursor = paginate(User.query, User.created_at, User.id, after, limit)
+    response = jsonify([user.to_dict() for user in users])
+    # The body stays a plain list, the next page is announced in a header
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @user_bp.route('/users', methods=['POST'])
 def create_user():
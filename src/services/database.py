@@ -0,0 +1,140 @@
+import logging
+import os
+from time import perf_counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+# Pool settings, unset values fall back to the per-backend defaults below
+DB_POOL_SIZE = os.getenv('DB_POOL_SIZE')
+DB_MAX_OVERFLOW = os.getenv('DB_MAX_OVERFLOW')
+DB_POOL_TIMEOUT = os.getenv('DB_POOL_TIMEOUT')
+DB_POOL_RECYCLE = os.getenv('DB_POOL_RECYCLE')
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING')
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))  # PostgreSQL only, 0 disables
+
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '15'))  # seconds
+
+SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', '250'))
+# A statement repeated this many times in one request is reported as a likely N+1
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', '10'))
+
+BACKEND_DEFAULTS = {
+    'postgresql': {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30, 'pool_recycle': 1800, 'pool_pre_ping': True},
+    'sqlite': {'pool_pre_ping': False},
+}
+
+
+def normalize_database_url(url):
+    # Heroku style postgres:// URLs are rejected by SQLAlchemy 2
+    if url and url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def _flag(value):
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for `url`: backend defaults overridden by the DB_* environment variables"""
+    if not url:
+        return {}
+    backend = make_url(url).get_backend_name()
+    options = dict(BACKEND_DEFAULTS.get(backend, {}))
+
+    if backend == 'sqlite':
+        options['connect_args'] = {'timeout': SQLITE_BUSY_TIMEOUT}
+        in_memory = make_url(url).database in (None, '', ':memory:')
+        if in_memory:
+            # A single shared connection, pool sizing does not apply
+            return options
+    elif backend == 'postgresql' and DB_STATEMENT_TIMEOUT_MS:
+        options['connect_args'] = {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'}
+
+    overrides = {
+        'pool_size': (DB_POOL_SIZE, int),
+        'max_overflow': (DB_MAX_OVERFLOW, int),
+        'pool_timeout': (DB_POOL_TIMEOUT, float),
+        'pool_recycle': (DB_POOL_RECYCLE, int),
+        'pool_pre_ping': (DB_POOL_PRE_PING, _flag),
+    }
+    for name, (value, convert) in overrides.items():
+        if value is not None and value != '':
+            options[name] = convert(value)
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        if SQLITE_JOURNAL_MODE:
+            cursor.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+        if SQLITE_SYNCHRONOUS:
+            cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = (perf_counter() - conn.info['query_start'].pop()) * 1000
+    if elapsed >= SQL_SLOW_QUERY_MS:
+        # Pool status tells a saturated pool apart from a slow database
+        logger.warning('Slow query (%.1f ms, %s): %s', elapsed, conn.engine.pool.status(),
+                       ' '.join(statement.split())[:1000])
+
+    if has_request_context():
+        timings = g.setdefault('sql_timings', {'count': 0, 'ms': 0.0, 'statements': {}})
+        timings['count'] += 1
+        timings['ms'] += elapsed
+        timings['statements'][statement] = timings['statements'].get(statement, 0) + 1
+
+
+def _handle_error(exception_context):
+    # Failed statements never reach after_cursor_execute
+    starts = exception_context.connection.info.get('query_start') if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+def _start_request_timer():
+    g.request_started = perf_counter()
+
+
+def _report_request_timings(response):
+    """Expose database vs total time in Server-Timing and flag repeated statements"""
+    timings = g.pop('sql_timings', None)
+    started = g.pop('request_started', None)
+    metrics = []
+    if timings:
+        metrics.append(f'db;dur={timings["ms"]:.1f};desc="{timings["count"]} queries"')
+        for statement, count in timings['statements'].items():
+            if count >= SQL_N_PLUS_ONE_THRESHOLD:
+                logger.warning('Possible N+1 in %s %s: statement ran %d times: %s',
+                               request.method, request.path, count, ' '.join(statement.split())[:500])
+    if started is not None:
+        metrics.append(f'app;dur={(perf_counter() - started) * 1000:.1f}')
+    if metrics:
+        response.headers.add('Server-Timing', ', '.join(metrics))
+    return response
+
+
+def configure_database(app, db):
+    """Install SQLite pragmas and per-statement timing on the app's engine; call inside an app context"""
+    engine = db.engine
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+    app.before_request(_start_request_timer)
+    app.after_request(_report_request_timings)
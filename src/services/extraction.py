@@ -0,0 +1,310 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from src.models.user import db, StoredFile
+from src.services.metrics import EXTRACTION_LATENCY, EXTRACTION_PAGES, timed
+from src.services.passages import update_passage_index, drop_passage_index
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_EXECUTOR = os.getenv('EXTRACTION_EXECUTOR', 'process')  # process, thread or inline
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Characters extracted at upload time, later generations extend the text on demand
+EXTRACTION_INITIAL_CHARS = int(os.getenv('EXTRACTION_INITIAL_CHARS', '50000'))
+# Seconds a file may stay pending before its extraction counts as lost, e.g. to a restart
+EXTRACTION_TIMEOUT = int(os.getenv('EXTRACTION_TIMEOUT', '300'))
+PREVIEW_CHARS = 500
+TEXT_PAGE_CHARS = 4000  # Size of the synthetic pages used for plain text and Word files
+
+WORD_TYPES = ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def _text_pages(file_path, start_page):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        index = 0
+        for block in iter(lambda: file.read(TEXT_PAGE_CHARS), ''):
+            if index >= start_page:
+                yield index, block
+            index += 1
+
+
+def _word_pages(file_path, start_page):
+    import docx  # Imported on first use, python-docx pulls in lxml
+
+    # python-docx parses the whole file up front, paragraphs are grouped into pages afterwards
+    doc = docx.Document(file_path)
+    index = 0
+    page = []
+    size = 0
+    for paragraph in doc.paragraphs:
+        page.append(paragraph.text + '\n')
+        size += len(paragraph.text) + 1
+        if size >= TEXT_PAGE_CHARS:
+            if index >= start_page:
+                yield index, ''.join(page)
+            index += 1
+            page = []
+            size = 0
+    if page and index >= start_page:
+        yield index, ''.join(page)
+
+
+def extract_pages(file_path, file_type, start_page=0, char_budget=None):
+    """Extract pages from `start_page` on until at least `char_budget` characters have been read.
+
+    Returns (pages, page_count): pages is a list of (page_index, text) and
+    page_count is the total number of pages, or None while it is unknown
+    because the end of the file has not been reached.
+    """
+    with timed(EXTRACTION_LATENCY, file_type=file_type):
+        pages, page_count = _extract_pages(file_path, file_type, start_page, char_budget)
+    EXTRACTION_PAGES.labels(file_type=file_type).observe(len(pages))
+    return pages, page_count
+
+
+def _extract_pages(file_path, file_type, start_page, char_budget):
+    try:
+        if file_type == 'application/pdf':
+            import PyPDF2
+
+            with open(file_path, 'rb') as file:
+                pdf_reader = PyPDF2.PdfReader(file)
+                page_count = len(pdf_reader.pages)
+                pages = []
+                size = 0
+                # Pages are only parsed when accessed, so stopping early skips the rest of the file
+                for index in range(start_page, page_count):
+                    text = (pdf_reader.pages[index].extract_text() or '') + '\n'
+                    pages.append((index, text))
+                    size += len(text)
+                    if char_budget is not None and size >= char_budget:
+                        break
+                return pages, page_count
+
+        if file_type == 'text/plain':
+            page_iter = _text_pages(file_path, start_page)
+        elif file_type in WORD_TYPES:
+            page_iter = _word_pages(file_path, start_page)
+        else:
+            raise ExtractionError('Unsupported file type for text extraction')
+
+        pages = []
+        size = 0
+        for index, text in page_iter:
+            pages.append((index, text))
+            size += len(text)
+            if char_budget is not None and size >= char_budget:
+                return pages, None
+        return pages, (pages[-1][0] + 1 if pages else start_page)
+
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f'Error extracting text: {str(e)}')
+
+
+def extract_text(file_path, file_type):
+    """Extract the full text content of an uploaded file, raising ExtractionError on failure"""
+    pages, _ = extract_pages(file_path, file_type)
+    # Collected and joined once, repeated += would copy the text for every page
+    return ''.join(text for _, text in pages)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if EXTRACTION_EXECUTOR == 'process':
+                _executor = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix='extraction')
+        return _executor
+
+
+def is_fully_extracted(blob):
+    return blob.page_count is not None and (blob.extracted_pages or 0) >= blob.page_count
+
+
+def apply_pages(blob, pages, page_count=None):
+    """Append newly extracted pages to the shared text and mark it ready.
+
+    The append is conditional on `extracted_pages` being unchanged, so two
+    workers extending the same file never add a page twice. Returns False
+    when another worker got there first; the blob is refreshed either way.
+    """
+    extracted_pages = blob.extracted_pages or 0
+    # Pages the blob already has are dropped
+    pages = [(index, text) for index, text in pages if index >= extracted_pages]
+    values = {'status': 'ready', 'extraction_error': None}
+    if pages:
+        content_text = (blob.content_text or '') + ''.join(text for _, text in pages)
+        values['content_text'] = content_text
+        values['content_preview'] = content_text[:PREVIEW_CHARS]
+        values['char_count'] = len(content_text)
+        values['extracted_pages'] = pages[-1][0] + 1
+    if page_count is not None:
+        values['page_count'] = page_count
+
+    updated = StoredFile.query.filter(
+        StoredFile.sha256 == blob.sha256,
+        db.func.coalesce(StoredFile.extracted_pages, 0) == extracted_pages
+    ).update(values, synchronize_session=False)
+    db.session.refresh(blob)
+    if updated == 1:
+        update_passage_index(blob)
+    return updated == 1
+
+
+def apply_extraction_error(blob, error):
+    drop_passage_index(blob.sha256)
+    blob.content_text = None
+    blob.content_preview = None
+    blob.char_count = 0
+    blob.extracted_pages = 0
+    blob.page_count = None
+    blob.status = 'failed'
+    blob.extraction_error = error
+
+
+def _plan(blob, char_budget):
+    """Return (start_page, missing_chars) still to extract for `char_budget`, or None"""
+    missing = char_budget - (blob.char_count or 0)
+    if missing <= 0 or is_fully_extracted(blob):
+        return None
+    return blob.extracted_pages or 0, missing
+
+
+def _store_result(app, sha256, future):
+    with app.app_context():
+        try:
+            blob = db.session.get(StoredFile, sha256)
+            if blob is None:
+                # Every document using the file was deleted while it was extracted
+                return
+            try:
+                pages, page_count = future.result()
+                apply_pages(blob, pages, page_count)
+            except ExtractionError as e:
+                apply_extraction_error(blob, str(e))
+            except Exception as e:
+                logger.exception('Extraction of file %s crashed', sha256)
+                apply_extraction_error(blob, f'Error extracting text: {str(e)}')
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception('Failed to store extraction result for file %s', sha256)
+        finally:
+            db.session.remove()
+
+
+def submit_extraction(app, blob, char_budget=EXTRACTION_INITIAL_CHARS):
+    """Extract the first `char_budget` characters of a stored file in the background"""
+    needed = _plan(blob, char_budget)
+    if needed is None:
+        blob.status = 'ready'
+        db.session.commit()
+        return None
+
+    if EXTRACTION_EXECUTOR == 'inline':
+        _extend(blob, char_budget)
+        db.session.commit()
+        return None
+
+    start_page, missing = needed
+    sha256 = blob.sha256
+    future = get_executor().submit(extract_pages, blob.file_path, blob.file_type, start_page, missing)
+    future.add_done_callback(lambda done: _store_result(app, sha256, done))
+    return future
+
+
+def resubmit_stale_extraction(app, blob):
+    """Extract a file again when it has been pending for over EXTRACTION_TIMEOUT.
+
+    Its result is only stored by a callback of the process that submitted it,
+    so a restart or a dead worker leaves the file pending for good. Returns
+    True when the extraction was submitted again.
+    """
+    if blob is None or blob.status != 'pending':
+        return False
+    cutoff = datetime.utcnow() - timedelta(seconds=EXTRACTION_TIMEOUT)
+    # Conditional on the old start time, so concurrent requests resubmit it once
+    claimed = StoredFile.query.filter(
+        StoredFile.sha256 == blob.sha256,
+        StoredFile.status == 'pending',
+        db.func.coalesce(StoredFile.extraction_started_at, StoredFile.created_at) < cutoff
+    ).update({'extraction_started_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    if claimed != 1:
+        return False
+    logger.warning('Extraction of file %s did not finish in %d seconds, submitting it again',
+                   blob.sha256, EXTRACTION_TIMEOUT)
+    db.session.refresh(blob)
+    submit_extraction(app, blob)
+    return True
+
+
+def _extend(blob, char_budget):
+    needed = _plan(blob, char_budget)
+    if needed is None:
+        return
+    start_page, missing = needed
+    try:
+        if EXTRACTION_EXECUTOR == 'inline':
+            pages, page_count = extract_pages(blob.file_path, blob.file_type, start_page, missing)
+        else:
+            pages, page_count = get_executor().submit(
+                extract_pages, blob.file_path, blob.file_type, start_page, missing
+            ).result()
+        apply_pages(blob, pages, page_count)
+    except ExtractionError as e:
+        if blob.char_count:
+            # Keep serving the pages extracted so far
+            logger.warning('Could not extend text of file %s: %s', blob.sha256, e)
+        else:
+            apply_extraction_error(blob, str(e))
+
+
+def ensure_text(document, char_budget):
+    """Make sure at least `char_budget` characters (or the whole file) are extracted and return the text"""
+    if document.blob is None:
+        return None
+    _extend(document.blob, char_budget)
+    db.session.commit()
+    return document.blob.content_text
+
+
+def reprocess_blobs(blobs, char_budget=EXTRACTION_INITIAL_CHARS):
+    """Re-extract stored files from scratch in parallel on the extraction pool, returning (ready, failed) counts"""
+    executor = get_executor()
+    futures = [(blob, executor.submit(extract_pages, blob.file_path, blob.file_type, 0, char_budget))
+               for blob in blobs]
+
+    ready = failed = 0
+    for blob, future in futures:
+        try:
+            pages, page_count = future.result()
+            blob.content_text = ''.join(text for _, text in pages)
+            blob.content_preview = blob.content_text[:PREVIEW_CHARS]
+            blob.char_count = len(blob.content_text)
+            blob.extracted_pages = pages[-1][0] + 1 if pages else 0
+            blob.page_count = page_count
+            blob.status = 'ready'
+            blob.extraction_error = None
+            drop_passage_index(blob.sha256)
+            update_passage_index(blob)
+            ready += 1
+        except Exception as e:
+            apply_extraction_error(blob, str(e))
+            failed += 1
+    db.session.commit()
+    return ready, failed
@@ -0,0 +1,125 @@
+import math
+import random
+import re
+import zlib
+from collections import Counter
+
+from src.services.passages import STOPWORDS, tokenize
+
+MIN_SENTENCE_CHARS = 40
+MAX_SENTENCE_CHARS = 300
+MIN_TERM_CHARS = 4
+OPTION_COUNT = 4
+# Most salient terms considered as distractors, and how many of the closest are sampled from
+DISTRACTOR_POOL = 200
+DISTRACTOR_SHORTLIST = 8
+BLANK = '_____'
+
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+_WORD = re.compile(r"[A-Za-z][A-Za-z'-]*[A-Za-z]")
+
+
+def split_sentences(text):
+    """Sentences of a quizzable length, whitespace collapsed, in document order"""
+    sentences = []
+    for raw in _SENTENCE_BREAK.split(text):
+        sentence = ' '.join(raw.split())
+        if MIN_SENTENCE_CHARS <= len(sentence) <= MAX_SENTENCE_CHARS:
+            sentences.append(sentence)
+    return sentences
+
+
+def _shape(form):
+    # Options read alike when they share capitalization and plural-looking endings
+    return form[:1].isupper(), form[-1:].lower() == 's'
+
+
+def generate_extractive_questions(content_text, question_count, custom_prompt=""):
+    """Cloze-style multiple choice questions built from the document text alone.
+
+    Sentences are ranked by the term-frequency salience of the words they
+    contain (boosted by overlap with `custom_prompt`); the most salient
+    unused term of each chosen sentence is blanked out and offered with
+    three distractors drawn from other salient terms of the document.
+    Deterministic for the same inputs. Returns at most `question_count`
+    questions, fewer when the text is too short.
+    """
+    sentences = split_sentences(content_text or '')
+    if not sentences or question_count <= 0:
+        return []
+
+    # Set and Counter operations keep the per-word work in C
+    sentence_frequency = Counter()
+    sentence_terms = []
+    for sentence in sentences:
+        terms = {word for word in set(_WORD.findall(sentence.lower()))
+                 if len(word) >= MIN_TERM_CHARS and not word.endswith('ly')} - STOPWORDS
+        sentence_frequency.update(terms)
+        sentence_terms.append(terms)
+
+    # Term frequencies and the most common spelling of each term, from the distinct surface forms
+    term_frequency = Counter()
+    display = {}
+    for word, count in Counter(_WORD.findall(' '.join(sentences))).most_common():
+        term = word.lower()
+        if term in sentence_frequency:
+            term_frequency[term] += count
+            display.setdefault(term, word)
+
+    total = len(sentences)
+    salience = {term: frequency * math.log(1 + total / sentence_frequency[term])
+                for term, frequency in term_frequency.items()}
+    pool = sorted(salience, key=salience.get, reverse=True)[:DISTRACTOR_POOL]
+    if len(pool) < OPTION_COUNT:
+        return []
+
+    prompt_terms = set(tokenize(custom_prompt or ''))
+    scores = []
+    for index, terms in enumerate(sentence_terms):
+        if not terms:
+            continue
+        score = sum(salience[term] for term in terms) / math.sqrt(len(terms))
+        if prompt_terms:
+            score *= 1 + len(prompt_terms.intersection(terms))
+        scores.append((score, index))
+    scores.sort(reverse=True)
+
+    seed = zlib.crc32(f'{question_count}\0{custom_prompt}\0'.encode('utf-8') + (content_text or '').encode('utf-8'))
+    rng = random.Random(seed)
+    used_answers = set()
+    chosen = []
+    for _, index in scores:
+        terms = sentence_terms[index]
+        candidates = [term for term in terms if term not in used_answers]
+        if not candidates:
+            continue
+        answer = max(candidates, key=salience.get)
+        shape = _shape(display[answer])
+        others = [term for term in pool if term != answer and term not in terms]
+        if len(others) < OPTION_COUNT - 1:
+            continue
+        # Stable sort keeps salience order among terms of the same shape
+        others.sort(key=lambda term: (_shape(display[term]) != shape,
+                                      abs(len(term) - len(answer)) > 3))
+        distractors = rng.sample(others[:DISTRACTOR_SHORTLIST], OPTION_COUNT - 1)
+
+        used_answers.add(answer)
+        chosen.append((index, answer, distractors))
+        if len(chosen) == question_count:
+            break
+
+    questions = []
+    for index, answer, distractors in sorted(chosen):
+        sentence = sentences[index]
+        cloze = re.sub(rf'\b{re.escape(answer)}\b', BLANK, sentence, flags=re.IGNORECASE)
+        options = [display[term] for term in distractors]
+        correct_answer = rng.randrange(OPTION_COUNT)
+        options.insert(correct_answer, display[answer])
+        questions.append({
+            'id': len(questions) + 1,
+            'question': f'Which term completes this statement from the document? "{cloze}"',
+            'options': options,
+            'correct_answer': correct_answer,
+            'explanation': f'The document states: "{sentence}"'
+        })
+    return questions
@@ -0,0 +1,105 @@
+import json
+import operator
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from src.models.user import db, Quiz, QuizResult
+
+ANSWER_KEY_CACHE_SIZE = 1024
+LETTERS = 'ABCDEFGHIJ'
+
+_answer_keys = OrderedDict()
+_answer_keys_lock = threading.Lock()
+
+
+class InvalidSubmission(Exception):
+    pass
+
+
+def get_answer_key(quiz):
+    """Tuple of correct option indexes for a quiz, decoded once per process.
+
+    `quiz` only needs id, created_at and questions_data; created_at is part of
+    the cache key so a reused id never serves a stale key.
+    """
+    cache_key = (quiz.id, quiz.created_at)
+    with _answer_keys_lock:
+        answer_key = _answer_keys.get(cache_key)
+        if answer_key is not None:
+            _answer_keys.move_to_end(cache_key)
+            return answer_key
+
+    questions = json.loads(quiz.questions_data or '[]')
+    answer_key = tuple(question.get('correct_answer', -1) for question in questions)
+    with _answer_keys_lock:
+        _answer_keys[cache_key] = answer_key
+        while len(_answer_keys) > ANSWER_KEY_CACHE_SIZE:
+            _answer_keys.popitem(last=False)
+    return answer_key
+
+
+def load_quiz_for_grading(quiz_id, user_id):
+    """Fetch the quiz row, skipping the questions JSON when its answer key is already cached"""
+    quiz = Quiz.query.options(db.defer(Quiz.questions_data)) \
+        .filter_by(id=quiz_id, user_id=user_id).first()
+    if quiz is None:
+        return None, None
+    with _answer_keys_lock:
+        answer_key = _answer_keys.get((quiz.id, quiz.created_at))
+    if answer_key is None:
+        # Loads the deferred column
+        answer_key = get_answer_key(quiz)
+    return quiz, answer_key
+
+
+def normalize_answers(answers, question_count):
+    """Map option indexes or letters to indexes, None for unanswered; pads or rejects to the quiz length"""
+    if not isinstance(answers, list):
+        raise InvalidSubmission('answers must be a list')
+    if len(answers) > question_count:
+        raise InvalidSubmission(f'Too many answers: quiz has {question_count} questions')
+
+    normalized = []
+    for answer in answers:
+        if isinstance(answer, bool):
+            raise InvalidSubmission('Answers must be option indexes or letters')
+        if isinstance(answer, int) or answer is None:
+            normalized.append(answer)
+        elif isinstance(answer, str) and len(answer.strip()) == 1 and answer.strip().upper() in LETTERS:
+            normalized.append(LETTERS.index(answer.strip().upper()))
+        else:
+            raise InvalidSubmission(f'Invalid answer: {answer!r}')
+    normalized.extend([None] * (question_count - len(normalized)))
+    return normalized
+
+
+def grade(answer_key, answers):
+    """Number of answers matching the key"""
+    return sum(map(operator.eq, answer_key, answers))
+
+
+def grade_sheets(quiz, answer_key, user_id, sheets):
+    """Grade many answer sheets and insert their QuizResult rows in a single statement.
+
+    `sheets` is a list of (participant, answers) with answers already
+    normalized. Returns the inserted rows as dicts, without committing.
+    """
+    total = len(answer_key)
+    completed_at = datetime.utcnow()
+    rows = []
+    for participant, answers in sheets:
+        score = grade(answer_key, answers)
+        rows.append({
+            'quiz_id': quiz.id,
+            'user_id': user_id,
+            'participant': participant,
+            'score': score,
+            'total_questions': total,
+            'percentage': round(score * 100.0 / total, 2) if total else 0.0,
+            'answers_data': json.dumps(answers),
+            'completed_at': completed_at
+        })
+    if rows:
+        db.session.execute(db.insert(QuizResult), rows)
+    return rows
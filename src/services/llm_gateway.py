@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import os
+import threading
+from time import monotonic, sleep
+
+from src.services.metrics import LLM_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '30'))  # seconds per OpenAI request, per read while streaming
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '1'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))  # calls in flight per process
+LLM_USER_CONCURRENCY = int(os.getenv('LLM_USER_CONCURRENCY', '2'))  # generations in flight per user
+LLM_ACQUIRE_TIMEOUT = float(os.getenv('LLM_ACQUIRE_TIMEOUT', '2'))  # seconds to wait for a rate token, then for a free call slot
+LLM_RATE = float(os.getenv('LLM_RATE', '10'))  # calls per second per process, 0 disables
+LLM_BURST = int(os.getenv('LLM_BURST', '20'))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))  # consecutive failures that open the circuit
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))  # seconds before a trial call
+
+
+class LLMUnavailable(Exception):
+    """The gateway refused the call without contacting OpenAI"""
+
+    def __init__(self, reason):
+        super().__init__(f'LLM call rejected: {reason}')
+        self.reason = reason
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, timeout=0.0):
+        """Take a token, waiting up to `timeout` seconds for one to refill"""
+        if self.rate <= 0:
+            return True
+        deadline = monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            # Give up early when the next token cannot arrive in time
+            if monotonic() + wait > deadline:
+                return False
+            sleep(wait)
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+
+class CircuitBreaker:
+    """Closed until `threshold` consecutive failures, then open for `cooldown` seconds.
+
+    After the cooldown one trial call is let through (half-open); its result
+    closes the circuit again or restarts the cooldown.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if monotonic() - self.opened_at < self.cooldown:
+            return 'open'
+        return 'half_open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info('LLM circuit closed')
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    logger.warning('LLM circuit opened after %d consecutive failures', self.failures)
+                self.opened_at = monotonic()
+            self.trial_running = False
+
+    def cancel_trial(self):
+        # A half-open trial that was admitted but never ran must not block the next one
+        with self._lock:
+            self.trial_running = False
+
+    def seconds_until_trial(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (monotonic() - self.opened_at))
+
+
+class LLMGateway:
+    """Single choke point for OpenAI calls.
+
+    Each call passes the circuit breaker, the token bucket and a process-wide
+    concurrency slot before it is made. Bursts of chunk calls wait briefly
+    (LLM_ACQUIRE_TIMEOUT) for a rate token and a slot; past that, or with the
+    circuit open, LLMUnavailable is raised so callers can fall back.
+    Per-user slots are taken once per generation by the routes.
+    """
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+        self.bucket = TokenBucket(LLM_RATE, LLM_BURST)
+        self._slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+        self._in_flight = 0
+        self._user_slots = {}
+        self._lock = threading.Lock()
+        self._rejected = {}
+
+    def _count_rejection(self, reason):
+        with self._lock:
+            self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        LLM_REJECTIONS.labels(reason=reason).inc()
+
+    def _reject(self, reason):
+        self._count_rejection(reason)
+        raise LLMUnavailable(reason)
+
+    def _admit(self):
+        if not self.breaker.allow():
+            self._reject('circuit_open')
+        if not self.bucket.take(LLM_ACQUIRE_TIMEOUT):
+            self.breaker.cancel_trial()
+            self._reject('rate_limited')
+        if not self._slots.acquire(timeout=LLM_ACQUIRE_TIMEOUT):
+            self.breaker.cancel_trial()
+            self._reject('busy')
+        with self._lock:
+            self._in_flight += 1
+
+    def _done(self, failed):
+        """Free the call slot; `failed` None means the call never finished and says nothing about the upstream"""
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+        if failed is None:
+            self.breaker.cancel_trial()
+        elif failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def call(self, function, **kwargs):
+        """Run a non-streaming completion `function(**kwargs)` under the gateway's limits"""
+        self._admit()
+        failed = True
+        try:
+            result = function(**kwargs)
+            failed = False
+            return result
+        finally:
+            self._done(failed)
+
+    async def acall(self, function, **kwargs):
+        """Await an async completion `function(**kwargs)` under the same limits as call()"""
+        # Waiting for a slot blocks, so it happens off the event loop
+        admission = asyncio.ensure_future(asyncio.to_thread(self._admit))
+        try:
+            await asyncio.shield(admission)
+        except asyncio.CancelledError:
+            # The thread may still get a slot after the caller is gone; hand it straight back
+            admission.add_done_callback(
+                lambda done: self._done(None) if not done.cancelled() and done.exception() is None else None)
+            raise
+        failed = True
+        try:
+            result = await function(**kwargs)
+            failed = False
+            return result
+        except asyncio.CancelledError:
+            # Cancelled by the caller, the call never finished so the breaker learns nothing from it
+            failed = None
+            raise
+        finally:
+            self._done(failed)
+
+    def stream(self, function, **kwargs):
+        """Yield the events of a streamed completion, holding a call slot until the stream ends"""
+        self._admit()
+        failed = True
+        try:
+            stream = function(**kwargs)
+            try:
+                for event in stream:
+                    yield event
+            finally:
+                close = getattr(stream, 'close', None)
+                if close:
+                    close()
+            failed = False
+        except GeneratorExit:
+            # The consumer stopped early, the upstream did nothing wrong
+            failed = False
+            raise
+        finally:
+            self._done(failed)
+
+    def try_acquire_user(self, user_id):
+        """Take one of the user's generation slots, False when all are in use"""
+        with self._lock:
+            count = self._user_slots.get(user_id, 0)
+            if count >= LLM_USER_CONCURRENCY:
+                allowed = False
+            else:
+                self._user_slots[user_id] = count + 1
+                allowed = True
+        if not allowed:
+            self._count_rejection('user_busy')
+        return allowed
+
+    def release_user(self, user_id):
+        with self._lock:
+            count = self._user_slots.get(user_id, 0) - 1
+            if count > 0:
+                self._user_slots[user_id] = count
+            else:
+                self._user_slots.pop(user_id, None)
+
+    def state(self):
+        with self._lock:
+            in_flight = self._in_flight
+            users = len(self._user_slots)
+            rejected = dict(self._rejected)
+        return {
+            'circuit': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'seconds_until_trial': round(self.breaker.seconds_until_trial(), 2),
+            'in_flight': in_flight,
+            'max_concurrency': LLM_MAX_CONCURRENCY,
+            'users_generating': users,
+            'user_concurrency': LLM_USER_CONCURRENCY,
+            'rate_per_second': LLM_RATE,
+            'bucket_tokens': round(self.bucket.available(), 2),
+            'timeout_seconds': LLM_TIMEOUT,
+            'rejected': rejected,
+        }
+
+
+llm_gateway = LLMGateway()
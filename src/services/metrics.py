@@ -0,0 +1,130 @@
+import os
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# With several gunicorn workers each process writes its samples under
+# PROMETHEUS_MULTIPROC_DIR (set by gunicorn.conf.py) and /metrics merges them
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LLM_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+PAGE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route',
+    ['blueprint', 'endpoint', 'method'], buckets=LATENCY_BUCKETS
+)
+REQUESTS = Counter(
+    'http_requests_total', 'Requests by route and status',
+    ['blueprint', 'endpoint', 'method', 'status']
+)
+EXTRACTION_LATENCY = Histogram(
+    'extraction_duration_seconds', 'Time spent extracting text from a file',
+    ['file_type', 'outcome'], buckets=LATENCY_BUCKETS
+)
+EXTRACTION_PAGES = Histogram(
+    'extraction_pages', 'Pages extracted per extraction call',
+    ['file_type'], buckets=PAGE_BUCKETS
+)
+LLM_LATENCY = Histogram(
+    'llm_request_duration_seconds', 'OpenAI completion latency, until the last streamed token for streams',
+    ['mode', 'outcome'], buckets=LLM_BUCKETS
+)
+LLM_TOKENS = Counter('llm_tokens_total', 'Tokens reported by OpenAI usage', ['kind'])
+LLM_REJECTIONS = Counter('llm_rejections_total', 'OpenAI calls refused by the gateway', ['reason'])
+GENERATION_FALLBACKS = Counter(
+    'quiz_generation_fallbacks_total', 'Generations that served mock questions',
+    ['mode', 'kind']
+)
+FALLBACK_QUESTIONS = Counter('quiz_fallback_questions_total', 'Mock questions served instead of model output', ['mode'])
+DB_COMMIT_LATENCY = Histogram('db_commit_duration_seconds', 'Session commit latency', buckets=LATENCY_BUCKETS)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe the duration of the block, labelled with outcome ok or error"""
+    started = perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(perf_counter() - started)
+
+
+def record_llm_usage(usage):
+    if usage is None:
+        return
+    LLM_TOKENS.labels(kind='prompt').inc(getattr(usage, 'prompt_tokens', 0) or 0)
+    LLM_TOKENS.labels(kind='completion').inc(getattr(usage, 'completion_tokens', 0) or 0)
+
+
+def record_fallback(mode, question_count, requested):
+    """Count mock questions served; kind is full when the model produced nothing"""
+    GENERATION_FALLBACKS.labels(mode=mode, kind='full' if question_count >= requested else 'partial').inc()
+    FALLBACK_QUESTIONS.labels(mode=mode).inc(question_count)
+
+
+@event.listens_for(Session, 'before_commit')
+def _start_commit_timer(session):
+    session.info['commit_started'] = perf_counter()
+
+
+@event.listens_for(Session, 'after_commit')
+def _observe_commit(session):
+    started = session.info.pop('commit_started', None)
+    if started is not None:
+        DB_COMMIT_LATENCY.observe(perf_counter() - started)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_commit_timer(session):
+    session.info.pop('commit_started', None)
+
+
+def _start_timer():
+    g.metrics_started = perf_counter()
+
+
+def _route_labels():
+    rule = request.url_rule
+    return {
+        'blueprint': request.blueprint or '',
+        # Endpoint names keep the label set bounded, unmatched URLs share one series
+        'endpoint': request.endpoint if rule is not None else 'unmatched',
+        'method': request.method
+    }
+
+
+def _record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None and request.endpoint != 'metrics':
+        labels = _route_labels()
+        REQUEST_LATENCY.labels(**labels).observe(perf_counter() - started)
+        REQUESTS.labels(status=str(response.status_code), **labels).inc()
+    return response
+
+
+def metrics_view():
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    """Time every request and serve the collected metrics at /metrics"""
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
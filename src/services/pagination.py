@@ -0,0 +1,83 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import request
+
+from src.models.user import db
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(timestamp, row_id):
+    payload = json.dumps([timestamp.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (timestamp, id) position encoded in an opaque cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(row_id, int) or isinstance(row_id, bool):
+            raise ValueError(row_id)
+        return datetime.fromisoformat(timestamp), row_id
+    except Exception:
+        raise InvalidCursor(cursor)
+
+
+def encode_offset_cursor(offset):
+    payload = json.dumps({'offset': offset}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_offset_cursor(cursor):
+    """Return the row offset encoded in a cursor of a ranked listing"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        offset = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))['offset']
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            raise ValueError(offset)
+        return offset
+    except Exception:
+        raise InvalidCursor(cursor)
+
+
+def page_args():
+    """Read ?cursor= and ?limit= from the request, raising InvalidCursor for a malformed cursor"""
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = request.args.get('cursor')
+    return (decode_cursor(cursor) if cursor else None), limit
+
+
+def offset_page_args():
+    """Like page_args for listings ordered by a computed rank, where the cursor is a row offset"""
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = request.args.get('cursor')
+    return (decode_offset_cursor(cursor) if cursor else 0), limit
+
+
+def paginate(query, timestamp_column, id_column, after=None, limit=DEFAULT_PAGE_SIZE):
+    """Return (items, next_cursor) for the page after `after`, newest first.
+
+    Rows are ordered by (timestamp, id) descending and the page starts with a
+    row-value comparison instead of an OFFSET, so with a matching composite
+    index every page costs the same no matter how deep it is. next_cursor is
+    None on the last page.
+    """
+    if after is not None:
+        query = query.filter(db.tuple_(timestamp_column, id_column) < tuple(after))
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
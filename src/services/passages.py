@@ -0,0 +1,158 @@
+import json
+import math
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+from src.models.user import db, PassageIndex
+
+PASSAGE_CHARS = 800
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN = re.compile(r'[a-z0-9]{2,}|[0-9]')
+_PASSAGE_BREAK = re.compile(r'\n\s*\n|(?<=[.!?])\s+')
+
+STOPWORDS = frozenset('''
+a about above after again against all also am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her here
+hers herself him himself his how if in into is it its itself just me more most my myself no nor not now of off
+on once only or other our ours ourselves out over own same she should so some such than that the their theirs
+them themselves then there these they this those through to too under until up very was we were what when where
+which while who whom why will with would you your yours yourself yourselves focus question
+questions quiz about please make generate only
+'''.split())
+
+_decoded = OrderedDict()
+_decoded_lock = threading.Lock()
+_DECODED_CACHE_SIZE = 64
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def split_passages(text, start=0, passage_chars=PASSAGE_CHARS):
+    """Return (start, end) offsets of passages of roughly `passage_chars` covering text[start:]"""
+    spans = []
+    passage_start = start
+    for match in _PASSAGE_BREAK.finditer(text, start):
+        if match.end() - passage_start >= passage_chars:
+            spans.append((passage_start, match.end()))
+            passage_start = match.end()
+    if passage_start < len(text):
+        spans.append((passage_start, len(text)))
+    return spans
+
+
+def _encode(data):
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+
+def _decode(index):
+    key = (index.sha256, index.indexed_chars)
+    with _decoded_lock:
+        data = _decoded.get(key)
+        if data is not None:
+            _decoded.move_to_end(key)
+            return data
+    data = json.loads(zlib.decompress(index.data).decode('utf-8'))
+    with _decoded_lock:
+        _decoded[key] = data
+        while len(_decoded) > _DECODED_CACHE_SIZE:
+            _decoded.popitem(last=False)
+    return data
+
+
+def update_passage_index(stored_file):
+    """Index the part of the stored file's text that is not indexed yet.
+
+    Passages and postings are only appended, so extending a partially
+    extracted document costs time proportional to the new text.
+    """
+    text = stored_file.content_text or ''
+    index = db.session.get(PassageIndex, stored_file.sha256)
+    if index is None:
+        index = PassageIndex(sha256=stored_file.sha256, indexed_chars=0)
+        data = {'passages': [], 'postings': {}, 'total_terms': 0}
+        db.session.add(index)
+    elif index.indexed_chars >= len(text):
+        return index
+    else:
+        data = _decode(index)
+        data = {'passages': list(data['passages']),
+                'postings': {term: list(postings) for term, postings in data['postings'].items()},
+                'total_terms': data['total_terms']}
+
+    passages = data['passages']
+    postings = data['postings']
+    for start, end in split_passages(text, index.indexed_chars):
+        counts = Counter(tokenize(text[start:end]))
+        passage_id = len(passages)
+        length = sum(counts.values())
+        passages.append([start, end, length])
+        data['total_terms'] += length
+        for term, frequency in counts.items():
+            # Flat [passage_id, frequency, ...] pairs keep the stored index small
+            postings.setdefault(term, []).extend((passage_id, frequency))
+
+    index.indexed_chars = len(text)
+    index.data = _encode(data)
+    return index
+
+
+def drop_passage_index(sha256):
+    PassageIndex.query.filter_by(sha256=sha256).delete(synchronize_session=False)
+
+
+def select_passages(stored_file, query, char_budget):
+    """Return the highest scoring passages for `query` in document order, within `char_budget` characters.
+
+    Returns None when the query matches nothing, so callers can fall back to
+    the plain document text.
+    """
+    terms = set(tokenize(query or ''))
+    if not terms:
+        return None
+
+    index = db.session.get(PassageIndex, stored_file.sha256)
+    if index is None or index.indexed_chars < (stored_file.char_count or 0):
+        index = update_passage_index(stored_file)
+        db.session.commit()
+    data = _decode(index)
+
+    passages = data['passages']
+    if not passages:
+        return None
+    average_length = data['total_terms'] / len(passages) or 1
+
+    scores = {}
+    for term in terms:
+        postings = data['postings'].get(term)
+        if not postings:
+            continue
+        document_frequency = len(postings) // 2
+        idf = math.log(1 + (len(passages) - document_frequency + 0.5) / (document_frequency + 0.5))
+        for i in range(0, len(postings), 2):
+            passage_id, frequency = postings[i], postings[i + 1]
+            length_norm = 1 - BM25_B + BM25_B * passages[passage_id][2] / average_length
+            scores[passage_id] = scores.get(passage_id, 0.0) + \
+                idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+
+    if not scores:
+        return None
+
+    chosen = []
+    used = 0
+    for passage_id in sorted(scores, key=scores.get, reverse=True):
+        start, end, _ = passages[passage_id]
+        if used + (end - start) > char_budget and chosen:
+            continue
+        chosen.append(passage_id)
+        used += end - start
+        if used >= char_budget:
+            break
+
+    text = stored_file.content_text
+    return '\n\n'.join(text[passages[i][0]:passages[i][1]].strip() for i in sorted(chosen))
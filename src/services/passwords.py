@@ -0,0 +1,104 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+logger = logging.getLogger(__name__)
+
+# werkzeug method string, e.g. scrypt:32768:8:1 or pbkdf2:sha256:600000
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_EXECUTOR = os.getenv('PASSWORD_HASH_EXECUTOR', 'thread')  # thread, process or inline
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Hash operations admitted at once (running plus queued), further logins get a 503 right away
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', str(PASSWORD_HASH_WORKERS * 2)))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _normalize_method(method):
+    """Spell out werkzeug's defaults so stored hash prefixes can be compared with the configured method"""
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return 'scrypt:32768:8:1'
+    if name == 'pbkdf2' and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+HASH_METHOD = _normalize_method(PASSWORD_HASH_METHOD)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if PASSWORD_HASH_EXECUTOR == 'process':
+                _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+            else:
+                # hashlib releases the GIL while it runs scrypt and PBKDF2
+                _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+        return _executor
+
+
+def _run(function, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    if PASSWORD_HASH_EXECUTOR == 'inline':
+        try:
+            return function(*args)
+        finally:
+            _slots.release()
+
+    try:
+        future = get_executor().submit(function, *args)
+    except Exception:
+        _slots.release()
+        raise
+    # The slot is freed when the pool finishes, so a hash that timed out still counts as pending
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        raise PasswordHasherBusy()
+
+
+def hash_password(password):
+    """Hash a password with the configured method on the hashing pool.
+
+    Raises PasswordHasherBusy when PASSWORD_HASH_MAX_PENDING hashes are
+    already in flight, or when the hash takes longer than PASSWORD_HASH_TIMEOUT.
+    """
+    return _run(generate_password_hash, password, HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    """Check a password against any hash werkzeug understands, on the hashing pool"""
+    if not password_hash:
+        return False
+    return _run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """True when a hash was made with a different method or cost than the configured one"""
+    return password_hash.split('$', 1)[0] != HASH_METHOD
+
+
+def upgrade_hash(user, password):
+    """Rehash a verified password with the current method; skipped when the pool is saturated"""
+    if not needs_rehash(user.password_hash):
+        return False
+    try:
+        user.password_hash = hash_password(password)
+        return True
+    except PasswordHasherBusy:
+        logger.info('Hashing pool busy, rehash of user %s postponed', user.id)
+        return False
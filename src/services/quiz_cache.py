@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from time import monotonic
+
+from src.models.user import db, QuizCacheEntry
+
+logger = logging.getLogger(__name__)
+
+QUIZ_CACHE_ENABLED = os.getenv('QUIZ_CACHE_ENABLED', '1') != '0'
+QUIZ_CACHE_MEMORY_SIZE = int(os.getenv('QUIZ_CACHE_MEMORY_SIZE', '256'))
+QUIZ_CACHE_MAX_ROWS = int(os.getenv('QUIZ_CACHE_MAX_ROWS', '10000'))
+QUIZ_CACHE_TTL = int(os.getenv('QUIZ_CACHE_TTL', str(7 * 24 * 3600)))  # seconds
+
+
+def make_cache_key(content_text, question_count, custom_prompt, model, temperature):
+    """Hash every input that changes what the model would answer"""
+    payload = json.dumps(
+        [content_text or '', question_count, custom_prompt or '', model, temperature],
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class QuizCache:
+    """Two-tier cache of generated quizzes.
+
+    The first tier is a bounded in-process LRU, the second a table shared by
+    every worker. Values are stored as the JSON string persisted on `Quiz`.
+    """
+
+    def __init__(self, memory_size=QUIZ_CACHE_MEMORY_SIZE, max_rows=QUIZ_CACHE_MAX_ROWS,
+                 ttl=QUIZ_CACHE_TTL, enabled=QUIZ_CACHE_ENABLED):
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.enabled = enabled
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'db_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            questions_data, stored_at = entry
+            if monotonic() - stored_at > self.ttl:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return questions_data
+
+    def _memory_set(self, key, questions_data, stored_at=None):
+        with self._lock:
+            self._memory[key] = (questions_data, stored_at if stored_at is not None else monotonic())
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return cached questions for `key`, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        questions_data = self._memory_get(key)
+        if questions_data is not None:
+            self._count('memory_hits')
+            return json.loads(questions_data)
+
+        try:
+            entry = db.session.get(QuizCacheEntry, key)
+            if entry is not None:
+                age = (datetime.utcnow() - entry.created_at).total_seconds()
+                if age > self.ttl:
+                    db.session.delete(entry)
+                    db.session.commit()
+                    self._count('evictions')
+                else:
+                    entry.hit_count = (entry.hit_count or 0) + 1
+                    entry.last_used_at = datetime.utcnow()
+                    questions_data = entry.questions_data
+                    db.session.commit()
+                    # Keep the remaining lifetime of the persistent entry
+                    self._memory_set(key, questions_data, monotonic() - age)
+                    self._count('db_hits')
+                    return json.loads(questions_data)
+        except Exception as e:
+            db.session.rollback()
+            logger.warning('Quiz cache lookup failed: %s', e)
+
+        self._count('misses')
+        return None
+
+    def set(self, key, questions):
+        """Store generated questions in both tiers"""
+        if not self.enabled:
+            return
+
+        questions_data = json.dumps(questions)
+        self._memory_set(key, questions_data)
+        self._count('stores')
+
+        try:
+            entry = db.session.get(QuizCacheEntry, key)
+            if entry is None:
+                db.session.add(QuizCacheEntry(key=key, questions_data=questions_data))
+            else:
+                entry.questions_data = questions_data
+                entry.created_at = datetime.utcnow()
+                entry.last_used_at = entry.created_at
+            db.session.commit()
+            self.evict()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning('Quiz cache store failed: %s', e)
+
+    def evict(self):
+        """Drop expired rows, then the least recently used ones over `max_rows`"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        removed = QuizCacheEntry.query.filter(QuizCacheEntry.created_at < cutoff).delete(synchronize_session=False)
+
+        overflow = QuizCacheEntry.query.count() - self.max_rows
+        if overflow > 0:
+            stale_keys = db.session.query(QuizCacheEntry.key) \
+                .order_by(QuizCacheEntry.last_used_at.asc()) \
+                .limit(overflow) \
+                .subquery()
+            removed += QuizCacheEntry.query.filter(QuizCacheEntry.key.in_(db.select(stale_keys.c.key))) \
+                .delete(synchronize_session=False)
+
+        db.session.commit()
+        if removed:
+            self._count('evictions', removed)
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        QuizCacheEntry.query.delete()
+        db.session.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['db_hits']) / lookups if lookups else 0.0
+        stats['enabled'] = self.enabled
+        return stats
+
+
+quiz_cache = QuizCache()
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from src.models.user import db, Document, Quiz, QuizJob
+from src.services.token_ledger import commit_reservation, refund_reservation
+
+logger = logging.getLogger(__name__)
+
+QUIZ_JOB_EXECUTOR = os.getenv('QUIZ_JOB_EXECUTOR', 'thread')  # thread or process
+QUIZ_JOB_WORKERS = int(os.getenv('QUIZ_JOB_WORKERS', '4'))
+QUIZ_JOB_TIMEOUT = int(os.getenv('QUIZ_JOB_TIMEOUT', '600'))  # seconds a running job may take before it counts as lost
+
+_executor = None
+_executor_lock = threading.Lock()
+_engine_reset_pid = None
+
+
+def get_executor(app):
+    """Create the worker pool on first use, pick up jobs left pending and fail those left running"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if QUIZ_JOB_EXECUTOR == 'process':
+                _executor = ProcessPoolExecutor(max_workers=QUIZ_JOB_WORKERS)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=QUIZ_JOB_WORKERS, thread_name_prefix='quiz-job')
+            with app.app_context():
+                fail_stale_jobs()
+                pending_ids = [job_id for (job_id,) in
+                               db.session.query(QuizJob.id).filter_by(status='pending').all()]
+            for job_id in pending_ids:
+                _submit(app, job_id)
+        return _executor
+
+
+def _submit(app, job_id):
+    if QUIZ_JOB_EXECUTOR == 'process':
+        # The app object cannot be pickled, the child process imports its own
+        _executor.submit(_run_in_process, job_id)
+    else:
+        _executor.submit(run_quiz_job, app, job_id)
+
+
+def _run_in_process(job_id):
+    global _engine_reset_pid
+    from src.main import app
+    if _engine_reset_pid != os.getpid():
+        # Connections inherited through fork belong to the parent process
+        with app.app_context():
+            db.engine.dispose(close=False)
+        _engine_reset_pid = os.getpid()
+    run_quiz_job(app, job_id)
+
+
+def enqueue_quiz_job(user_id, document_id, question_count, custom_prompt='', reservation_id=None):
+    """Persist a generation job and hand it to the worker pool.
+
+    `reservation_id` is the token hold paying for the job, it is kept when the
+    job succeeds and refunded otherwise.
+    """
+    job = QuizJob(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        document_id=document_id,
+        question_count=question_count,
+        custom_prompt=custom_prompt,
+        reservation_id=reservation_id
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    get_executor(app)
+    _submit(app, job.id)
+    return job
+
+
+def _claim(job_id):
+    """Atomically move a job from pending to running, so only one worker runs it"""
+    claimed = QuizJob.query.filter_by(id=job_id, status='pending') \
+        .update({'status': 'running', 'started_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def fail_stale_jobs(job_id=None):
+    """Fail and refund jobs stuck in running past QUIZ_JOB_TIMEOUT, their worker is gone.
+
+    Limited to `job_id` when given. Returns the number of jobs failed.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=QUIZ_JOB_TIMEOUT)
+    query = db.session.query(QuizJob.id, QuizJob.reservation_id) \
+        .filter(QuizJob.status == 'running', QuizJob.started_at < cutoff)
+    if job_id:
+        query = query.filter(QuizJob.id == job_id)
+    failed = 0
+    for stale_id, reservation_id in query.all():
+        # Conditional on the status, so two processes recovering the same job refund it once
+        updated = QuizJob.query.filter_by(id=stale_id, status='running').update(
+            {'status': 'failed', 'error': 'Quiz generation did not finish in time',
+             'finished_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if updated == 1:
+            failed += 1
+            if reservation_id:
+                refund_reservation(reservation_id)
+    if failed:
+        logger.warning('Failed %d quiz jobs left running for over %d seconds', failed, QUIZ_JOB_TIMEOUT)
+    return failed
+
+
+def _fail(job_id, error):
+    db.session.rollback()
+    QuizJob.query.filter_by(id=job_id).update(
+        {'status': 'failed', 'error': error, 'finished_at': datetime.utcnow()},
+        synchronize_session=False
+    )
+    db.session.commit()
+    job = db.session.get(QuizJob, job_id)
+    if job.reservation_id:
+        refund_reservation(job.reservation_id)
+
+
+def run_quiz_job(app, job_id):
+    """Run one generation job; its token reservation is only kept when it succeeds"""
+    # Imported here to avoid a circular import with the quiz routes
+    from src.routes.quiz import run_quiz_generation, load_source_text
+
+    with app.app_context():
+        try:
+            if not _claim(job_id):
+                return
+
+            job = db.session.get(QuizJob, job_id)
+            document = Document.query.filter_by(id=job.document_id, user_id=job.user_id).first()
+            if not document:
+                return _fail(job_id, 'Document not found')
+            if document.status != 'ready':
+                return _fail(job_id, f'Document is not ready ({document.status})')
+
+            content_text = load_source_text(document, job.question_count, job.custom_prompt)
+            questions, from_model = run_quiz_generation(content_text, job.question_count, job.custom_prompt)
+
+            quiz = Quiz(
+                document_id=document.id,
+                user_id=job.user_id,
+                title=f"Quiz for {document.original_filename}",
+                custom_prompt=job.custom_prompt,
+                question_count=job.question_count,
+                questions_data=json.dumps(questions)
+            )
+            db.session.add(quiz)
+            db.session.flush()
+
+            job.quiz_id = quiz.id
+            job.status = 'succeeded'
+            job.finished_at = datetime.utcnow()
+            if job.reservation_id and from_model:
+                # Fallback questions are free, only the model's are charged
+                commit_reservation(job.reservation_id, reference=f'quiz:{quiz.id}', amount=from_model)
+            db.session.commit()
+
+            if job.reservation_id and not from_model:
+                # The model failed, fallback questions are free
+                refund_reservation(job.reservation_id)
+
+        except Exception as e:
+            logger.exception('Quiz job %s failed', job_id)
+            _fail(job_id, f'Quiz generation failed: {str(e)}')
+        finally:
+            db.session.remove()
@@ -0,0 +1,154 @@
+import json
+import re
+
+_WHITESPACE = re.compile(r'\s+')
+_NON_WORD = re.compile(r'[^a-z0-9 ]+')
+
+
+def split_into_chunks(content_text, chunk_chars):
+    """Split text into chunks of at most `chunk_chars`, preferring paragraph and sentence breaks"""
+    text = (content_text or '').strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            window = text[start:end]
+            # Break on the last paragraph, then sentence, then word boundary in the back half
+            for separator in ('\n\n', '\n', '. ', ' '):
+                cut = window.rfind(separator, chunk_chars // 2)
+                if cut != -1:
+                    end = start + cut + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end
+    return chunks
+
+
+def plan_chunks(chunks, question_count, questions_per_chunk):
+    """Pick chunks spread evenly over the document and share the question count between them.
+
+    Returns a list of (chunk, count) pairs whose counts sum to `question_count`,
+    none asking for more than `questions_per_chunk`. Short documents reuse
+    their chunks so a large quiz is still split into small requests.
+    """
+    if not chunks:
+        return []
+
+    wanted = max(1, -(-question_count // questions_per_chunk))
+    if len(chunks) > wanted:
+        step = len(chunks) / wanted
+        chunks = [chunks[int(i * step + step / 2)] for i in range(wanted)]
+    elif len(chunks) < wanted:
+        # Repeats stay next to each other so questions still follow the document
+        chunks = [chunks[i * len(chunks) // wanted] for i in range(wanted)]
+
+    base, remainder = divmod(question_count, len(chunks))
+    plan = []
+    for i, chunk in enumerate(chunks):
+        count = base + (1 if i < remainder else 0)
+        if count:
+            plan.append((chunk, count))
+    return plan
+
+
+def question_key(question):
+    """Normalized question text used to spot duplicates"""
+    text = _NON_WORD.sub('', (question.get('question') or '').lower())
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def is_valid_question(question):
+    return (
+        isinstance(question, dict)
+        and isinstance(question.get('question'), str)
+        and isinstance(question.get('options'), list)
+        and len(question['options']) >= 2
+        and isinstance(question.get('correct_answer'), int)
+        and 0 <= question['correct_answer'] < len(question['options'])
+    )
+
+
+def merge_questions(batches, question_count):
+    """Merge per-chunk batches in document order, dropping malformed and duplicate questions"""
+    merged = []
+    seen = set()
+    for batch in batches:
+        for question in batch:
+            if not is_valid_question(question):
+                continue
+            key = question_key(question)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(question)
+            if len(merged) == question_count:
+                return renumber(merged)
+    return renumber(merged)
+
+
+def renumber(questions, start=1):
+    for i, question in enumerate(questions, start):
+        question['id'] = i
+    return questions
+
+
+class QuestionStreamParser:
+    """Incrementally parse streamed model output and return each question object once it is complete.
+
+    Any JSON object whose parent container is an array is treated as a
+    question, which covers both `{"questions": [...]}` and a bare array.
+    Text outside the JSON (such as a leading sentence) is ignored.
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._base = 0  # Absolute offset of the first character still buffered
+        self._length = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._start = None
+
+    def feed(self, text):
+        questions = []
+        offset = self._length
+        self._buffer.append(text)
+        self._length += len(text)
+
+        for i, char in enumerate(text, offset):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                # Strings only matter inside JSON, stray quotes in prose are skipped
+                self._in_string = bool(self._stack)
+            elif char in '{[':
+                if char == '{' and self._stack and self._stack[-1] == '[' and self._start is None:
+                    self._start = (i, len(self._stack))
+                self._stack.append(char)
+            elif char in '}]' and self._stack:
+                self._stack.pop()
+                if char == '}' and self._start is not None and len(self._stack) == self._start[1]:
+                    question = self._decode(self._start[0], i + 1)
+                    if question is not None:
+                        questions.append(question)
+                    self._start = None
+        return questions
+
+    def _decode(self, start, end):
+        text = ''.join(self._buffer)
+        # Everything before the end of this object has been consumed
+        self._buffer = [text[end - self._base:]]
+        obj_text = text[start - self._base:end - self._base]
+        self._base = end
+        try:
+            return json.loads(obj_text)
+        except ValueError:
+            return None
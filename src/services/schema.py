@@ -0,0 +1,62 @@
+import logging
+
+from sqlalchemy import inspect
+
+from src.models.user import db
+from src.services.search import ensure_search_schema
+
+logger = logging.getLogger(__name__)
+
+
+def _column_ddl(column, dialect):
+    ddl = f'{dialect.identifier_preparer.quote(column.name)} {column.type.compile(dialect=dialect)}'
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        literal = column.type.literal_processor(dialect)
+        ddl += f' DEFAULT {literal(default) if literal else repr(default)}'
+        if not column.nullable:
+            ddl += ' NOT NULL'
+    return ddl
+
+
+def migrate():
+    """Bring the database schema up to date with the models and return the changes made.
+
+    Creates missing tables, then adds columns and indexes that are missing
+    from existing tables. Columns are only ever added, never altered or
+    dropped; a NOT NULL column without a scalar default is added as nullable.
+    Finally the full-text search indexes are created, see services.search.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    changes = []
+
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                table.create(connection)
+                changes.append(f'created table {table.name}')
+                continue
+
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                table_name = engine.dialect.identifier_preparer.quote(table.name)
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table_name} ADD COLUMN {_column_ddl(column, engine.dialect)}'
+                )
+                changes.append(f'added column {table.name}.{column.name}')
+
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+                    changes.append(f'created index {index.name}')
+
+        changes.extend(ensure_search_schema(connection))
+
+    for change in changes:
+        logger.info('Schema migration: %s', change)
+    return changes
@@ -0,0 +1,273 @@
+import logging
+import re
+
+from markupsafe import escape
+
+from src.models.user import db, Document, Quiz
+
+logger = logging.getLogger(__name__)
+
+# Characters of a document's text that are indexed; part of the index DDL, so a change needs a rebuild
+SEARCH_INDEX_CHARS = 200000
+SEARCH_LANGUAGE = 'english'
+SNIPPET_TOKENS = 16
+# Characters of text Postgres scans for the snippet of each result
+HEADLINE_CHARS = 20000
+
+# Match markers that cannot occur in extracted text; the snippet is escaped before they become <mark> tags
+_START = '\x02'
+_STOP = '\x03'
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+# SQLite: FTS5 tables holding a copy of each document's and quiz's text, keyed by the owner's
+# row id and kept current by triggers. The owner column lets FTS5 intersect the user's rows
+# with the matches instead of ranking every user's documents.
+_SQLITE_TABLES = {
+    'document_search': '''
+        CREATE VIRTUAL TABLE document_search USING fts5(
+            owner, body, tokenize = 'porter unicode61 remove_diacritics 2'
+        )''',
+    'quiz_search': '''
+        CREATE VIRTUAL TABLE quiz_search USING fts5(
+            owner, title, custom_prompt, questions, tokenize = 'porter unicode61 remove_diacritics 2'
+        )''',
+}
+
+_SQLITE_QUIZ_QUESTIONS = '''(
+    SELECT group_concat(coalesce(json_extract(question.value, '$.question'), '') || ' ' ||
+                        coalesce((SELECT group_concat(choice.value, ' ')
+                                  FROM json_each(question.value, '$.options') AS choice), '') || ' ' ||
+                        coalesce(json_extract(question.value, '$.explanation'), ''), ' ')
+    FROM json_each(CASE WHEN json_valid({row}.questions_data) THEN {row}.questions_data ELSE '[]' END) AS question
+)'''
+
+_SQLITE_TRIGGERS = {
+    'document_search_insert': f'''
+        CREATE TRIGGER document_search_insert AFTER INSERT ON document BEGIN
+            INSERT INTO document_search (rowid, owner, body)
+            SELECT new.id, 'u' || new.user_id, substr(content_text, 1, {SEARCH_INDEX_CHARS})
+            FROM stored_file WHERE sha256 = new.file_hash;
+        END''',
+    'document_search_update': f'''
+        CREATE TRIGGER document_search_update AFTER UPDATE OF user_id, file_hash ON document BEGIN
+            DELETE FROM document_search WHERE rowid = old.id;
+            INSERT INTO document_search (rowid, owner, body)
+            SELECT new.id, 'u' || new.user_id, substr(content_text, 1, {SEARCH_INDEX_CHARS})
+            FROM stored_file WHERE sha256 = new.file_hash;
+        END''',
+    'document_search_delete': '''
+        CREATE TRIGGER document_search_delete AFTER DELETE ON document BEGIN
+            DELETE FROM document_search WHERE rowid = old.id;
+        END''',
+    # Extraction appends pages to the shared text, every document of the file is reindexed
+    'stored_file_search_update': f'''
+        CREATE TRIGGER stored_file_search_update AFTER UPDATE OF content_text ON stored_file BEGIN
+            DELETE FROM document_search WHERE rowid IN (SELECT id FROM document WHERE file_hash = new.sha256);
+            INSERT INTO document_search (rowid, owner, body)
+            SELECT id, 'u' || user_id, substr(new.content_text, 1, {SEARCH_INDEX_CHARS})
+            FROM document WHERE file_hash = new.sha256;
+        END''',
+    'quiz_search_insert': f'''
+        CREATE TRIGGER quiz_search_insert AFTER INSERT ON quiz BEGIN
+            INSERT INTO quiz_search (rowid, owner, title, custom_prompt, questions)
+            VALUES (new.id, 'u' || new.user_id, new.title, new.custom_prompt, {_SQLITE_QUIZ_QUESTIONS.format(row='new')});
+        END''',
+    'quiz_search_update': f'''
+        CREATE TRIGGER quiz_search_update AFTER UPDATE OF user_id, title, custom_prompt, questions_data ON quiz BEGIN
+            DELETE FROM quiz_search WHERE rowid = old.id;
+            INSERT INTO quiz_search (rowid, owner, title, custom_prompt, questions)
+            VALUES (new.id, 'u' || new.user_id, new.title, new.custom_prompt, {_SQLITE_QUIZ_QUESTIONS.format(row='new')});
+        END''',
+    'quiz_search_delete': '''
+        CREATE TRIGGER quiz_search_delete AFTER DELETE ON quiz BEGIN
+            DELETE FROM quiz_search WHERE rowid = old.id;
+        END''',
+}
+
+_SQLITE_POPULATE = {
+    'document_search': f'''
+        INSERT INTO document_search (rowid, owner, body)
+        SELECT document.id, 'u' || document.user_id, substr(stored_file.content_text, 1, {SEARCH_INDEX_CHARS})
+        FROM document JOIN stored_file ON stored_file.sha256 = document.file_hash''',
+    'quiz_search': f'''
+        INSERT INTO quiz_search (rowid, owner, title, custom_prompt, questions)
+        SELECT quiz.id, 'u' || quiz.user_id, quiz.title, quiz.custom_prompt, {_SQLITE_QUIZ_QUESTIONS.format(row='quiz')}
+        FROM quiz''',
+}
+
+# Postgres: stored generated tsvector columns, maintained by the database on every write, with GIN indexes
+_POSTGRES_COLUMNS = {
+    'stored_file': f'''
+        to_tsvector('{SEARCH_LANGUAGE}'::regconfig, left(coalesce(content_text, ''), {SEARCH_INDEX_CHARS}))''',
+    'quiz': f'''
+        setweight(to_tsvector('{SEARCH_LANGUAGE}'::regconfig, coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_LANGUAGE}'::regconfig, coalesce(custom_prompt, '')), 'B') ||
+        setweight(jsonb_to_tsvector('{SEARCH_LANGUAGE}'::regconfig, coalesce(questions_data, '[]')::jsonb, '["string"]'), 'C')''',
+}
+
+
+class InvalidSearchQuery(Exception):
+    pass
+
+
+def _sqlite_objects(connection, kind):
+    return {row[0] for row in connection.exec_driver_sql(
+        'SELECT name FROM sqlite_master WHERE type = ?', (kind,))}
+
+
+def ensure_search_schema(connection):
+    """Create the full-text indexes for the connection's backend, returning the changes made"""
+    changes = []
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        tables = _sqlite_objects(connection, 'table')
+        for name, ddl in _SQLITE_TABLES.items():
+            if name not in tables:
+                connection.exec_driver_sql(ddl)
+                connection.exec_driver_sql(_SQLITE_POPULATE[name])
+                changes.append(f'created search index {name}')
+        triggers = _sqlite_objects(connection, 'trigger')
+        for name, ddl in _SQLITE_TRIGGERS.items():
+            if name not in triggers:
+                connection.exec_driver_sql(ddl)
+                changes.append(f'created trigger {name}')
+    elif dialect == 'postgresql':
+        for table, expression in _POSTGRES_COLUMNS.items():
+            exists = connection.exec_driver_sql(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = %(table)s AND column_name = 'search_vector'",
+                {'table': table}
+            ).first()
+            if not exists:
+                # Adding a stored generated column computes it for the existing rows
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({expression}) STORED')
+                changes.append(f'added column {table}.search_vector')
+            connection.exec_driver_sql(
+                f'CREATE INDEX IF NOT EXISTS ix_{table}_search_vector ON {table} USING gin (search_vector)')
+    else:
+        logger.warning('Full-text search is not supported on %s', dialect)
+    return changes
+
+
+def rebuild_search_index():
+    """Refill the SQLite search tables from the documents and quizzes; Postgres needs no rebuild"""
+    connection = db.session.connection()
+    if connection.dialect.name != 'sqlite':
+        return False
+    for name, populate in _SQLITE_POPULATE.items():
+        connection.exec_driver_sql(f'DELETE FROM {name}')
+        connection.exec_driver_sql(populate)
+    db.session.commit()
+    return True
+
+
+def _terms(query):
+    terms = _TERM.findall(query or '')
+    if not terms:
+        raise InvalidSearchQuery(query)
+    return terms
+
+
+def _match_expression(user_id, terms):
+    # Every term is quoted, so user input can never be read as FTS5 query syntax
+    return f'owner:u{int(user_id)} AND ' + ' AND '.join(f'"{term}"' for term in terms)
+
+
+def _snippet(text):
+    if not text:
+        return ''
+    return str(escape(text)).replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def _page(rows, model, limit):
+    """Load the page's rows in rank order; returns ([(instance, snippet, score)], has_more)"""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    options = [db.joinedload(Document.blob)] if model is Document else []
+    instances = {instance.id: instance for instance in
+                 model.query.options(*options).filter(model.id.in_([row.id for row in rows])).all()}
+    return [(instances[row.id], _snippet(row.snippet), row.score) for row in rows if row.id in instances], has_more
+
+
+def search_documents(user_id, query, offset=0, limit=20):
+    """Rank the user's documents by how well their text matches `query`.
+
+    Returns ([(document, snippet, score)], has_more); snippets are HTML
+    escaped with the matched terms in <mark> tags. Raises
+    InvalidSearchQuery when the query has no searchable terms.
+    """
+    terms = _terms(query)
+    if db.engine.dialect.name == 'sqlite':
+        rows = db.session.execute(db.text(f'''
+            SELECT rowid AS id, -bm25(document_search, 0.0, 1.0) AS score,
+                   snippet(document_search, 1, :start, :stop, '…', {SNIPPET_TOKENS}) AS snippet
+            FROM document_search
+            WHERE document_search MATCH :match
+            ORDER BY score DESC, rowid DESC
+            LIMIT :limit OFFSET :offset
+        '''), {'match': _match_expression(user_id, terms), 'start': _START, 'stop': _STOP,
+               'limit': limit + 1, 'offset': offset}).all()
+    else:
+        rows = db.session.execute(db.text(f'''
+            WITH ranked AS (
+                SELECT document.id, document.file_hash, ts_rank_cd(stored_file.search_vector, query) AS score, query
+                FROM document
+                JOIN stored_file ON stored_file.sha256 = document.file_hash,
+                     plainto_tsquery('{SEARCH_LANGUAGE}', :query) AS query
+                WHERE document.user_id = :user_id AND stored_file.search_vector @@ query
+                ORDER BY score DESC, document.id DESC
+                LIMIT :limit OFFSET :offset
+            )
+            SELECT ranked.id, ranked.score,
+                   ts_headline('{SEARCH_LANGUAGE}', left(stored_file.content_text, {HEADLINE_CHARS}), ranked.query,
+                               :headline_options) AS snippet
+            FROM ranked JOIN stored_file ON stored_file.sha256 = ranked.file_hash
+            ORDER BY ranked.score DESC, ranked.id DESC
+        '''), {'query': ' '.join(terms), 'user_id': user_id, 'limit': limit + 1, 'offset': offset,
+               'headline_options': _headline_options()}).all()
+    return _page(rows, Document, limit)
+
+
+def search_quizzes(user_id, query, offset=0, limit=20):
+    """Rank the user's quizzes by matches in the title, custom prompt and questions, see search_documents"""
+    terms = _terms(query)
+    if db.engine.dialect.name == 'sqlite':
+        rows = db.session.execute(db.text(f'''
+            SELECT rowid AS id, -bm25(quiz_search, 0.0, 10.0, 5.0, 1.0) AS score,
+                   -- The owner term matches too, so the snippet comes from the first content column with a hit
+                   CASE WHEN instr(snippet(quiz_search, 3, :start, :stop, '…', {SNIPPET_TOKENS}), :start)
+                        THEN snippet(quiz_search, 3, :start, :stop, '…', {SNIPPET_TOKENS})
+                        WHEN instr(snippet(quiz_search, 2, :start, :stop, '…', {SNIPPET_TOKENS}), :start)
+                        THEN snippet(quiz_search, 2, :start, :stop, '…', {SNIPPET_TOKENS})
+                        ELSE snippet(quiz_search, 1, :start, :stop, '…', {SNIPPET_TOKENS}) END AS snippet
+            FROM quiz_search
+            WHERE quiz_search MATCH :match
+            ORDER BY score DESC, rowid DESC
+            LIMIT :limit OFFSET :offset
+        '''), {'match': _match_expression(user_id, terms), 'start': _START, 'stop': _STOP,
+               'limit': limit + 1, 'offset': offset}).all()
+    else:
+        rows = db.session.execute(db.text(f'''
+            WITH ranked AS (
+                SELECT quiz.id, ts_rank_cd(quiz.search_vector, query) AS score, query
+                FROM quiz, plainto_tsquery('{SEARCH_LANGUAGE}', :query) AS query
+                WHERE quiz.user_id = :user_id AND quiz.search_vector @@ query
+                ORDER BY score DESC, quiz.id DESC
+                LIMIT :limit OFFSET :offset
+            )
+            SELECT ranked.id, ranked.score,
+                   ts_headline('{SEARCH_LANGUAGE}',
+                               quiz.title || ' ' || coalesce(quiz.custom_prompt, '') || ' ' ||
+                               coalesce((SELECT string_agg(question->>'question', ' ')
+                                         FROM jsonb_array_elements(quiz.questions_data::jsonb) AS question), ''),
+                               ranked.query, :headline_options) AS snippet
+            FROM ranked JOIN quiz ON quiz.id = ranked.id
+            ORDER BY ranked.score DESC, ranked.id DESC
+        '''), {'query': ' '.join(terms), 'user_id': user_id, 'limit': limit + 1, 'offset': offset,
+               'headline_options': _headline_options()}).all()
+    return _page(rows, Quiz, limit)
+
+
+def _headline_options():
+    return f'StartSel={_START}, StopSel={_STOP}, MaxWords={SNIPPET_TOKENS * 2}, MinWords={SNIPPET_TOKENS // 2}'
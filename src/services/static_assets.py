@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import stat as stat_module
+import threading
+
+from flask import Response, request
+from werkzeug.security import safe_join
+
+try:
+    import brotli  # Optional, without it only gzip variants are built
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_HOT_RELOAD = os.getenv('STATIC_HOT_RELOAD', '0') == '1'
+STATIC_SHORT_MAX_AGE = int(os.getenv('STATIC_SHORT_MAX_AGE', '60'))  # seconds, index.html and unhashed files
+STATIC_MAX_CACHED_BYTES = int(os.getenv('STATIC_MAX_CACHED_BYTES', str(8 * 1024 * 1024)))  # larger files stay on disk
+COMPRESS_MIN_BYTES = 512
+
+# Bundler output such as index-4f3a9c1b.js or main.8d7e6f5a.css, the name changes with the content
+HASHED_NAME = re.compile(r'[.-](?=[A-Za-z0-9_]*\d)[A-Za-z0-9_]{8,}\.[A-Za-z0-9]+$')
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml',
+                      'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon', 'application/wasm')
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+
+class StaticAsset:
+    __slots__ = ('path', 'mtime', 'mimetype', 'etag', 'cache_control', 'variants')
+
+    def __init__(self, path, mtime, data, mimetype, hashed, precompressed):
+        self.path = path
+        self.mtime = mtime
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(data).hexdigest()[:32]
+        self.cache_control = IMMUTABLE_CACHE if hashed else f'public, max-age={STATIC_SHORT_MAX_AGE}'
+        # encoding -> body; 'identity' is always present
+        self.variants = {'identity': data}
+        self.variants.update(precompressed)
+        if mimetype.startswith(COMPRESSIBLE_TYPES) and len(data) >= COMPRESS_MIN_BYTES:
+            if 'gzip' not in self.variants:
+                self.variants['gzip'] = gzip.compress(data, compresslevel=9, mtime=0)
+            if 'br' not in self.variants and brotli is not None:
+                self.variants['br'] = brotli.compress(data, quality=11)
+        # Variants that do not save anything are dropped
+        for encoding in [name for name in self.variants if name != 'identity']:
+            if len(self.variants[encoding]) >= len(data):
+                del self.variants[encoding]
+
+
+class StaticManifest:
+    """In-memory copy of the static folder with precompressed variants.
+
+    Built once at startup, so serving a file needs no filesystem access. With
+    hot reload enabled the requested file is re-read whenever its mtime
+    changes, for frontend development.
+    """
+
+    def __init__(self, folder, hot_reload=STATIC_HOT_RELOAD):
+        self.folder = folder
+        self.hot_reload = hot_reload
+        self._assets = {}
+        self._large = set()  # Files above STATIC_MAX_CACHED_BYTES, served from disk
+        self._lock = threading.Lock()
+        if folder and os.path.isdir(folder):
+            self._scan()
+
+    def _scan(self):
+        assets = {}
+        for directory, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                if filename.endswith(('.gz', '.br')):
+                    continue
+                path = os.path.relpath(os.path.join(directory, filename), self.folder).replace(os.sep, '/')
+                asset = self._load(path)
+                if asset is not None:
+                    assets[path] = asset
+                else:
+                    self._large.add(path)
+        self._assets = assets
+        total = sum(len(asset.variants['identity']) for asset in assets.values())
+        logger.info('Static manifest: %d files, %d bytes', len(assets), total)
+
+    def _full_path(self, path):
+        # None for request paths that would resolve outside the static folder
+        return safe_join(self.folder, path)
+
+    def _load(self, path):
+        full_path = self._full_path(path)
+        if full_path is None:
+            return None
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+        # Directories and other non-files are served like missing files
+        if not stat_module.S_ISREG(stat.st_mode) or stat.st_size > STATIC_MAX_CACHED_BYTES:
+            return None
+        with open(full_path, 'rb') as file:
+            data = file.read()
+        precompressed = {}
+        # Variants produced by the frontend build are used as they are
+        for encoding, suffix in (('gzip', '.gz'), ('br', '.br')):
+            if os.path.exists(full_path + suffix):
+                with open(full_path + suffix, 'rb') as file:
+                    precompressed[encoding] = file.read()
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        return StaticAsset(path, stat.st_mtime, data, mimetype, bool(HASHED_NAME.search(path)), precompressed)
+
+    def get(self, path):
+        if not self.hot_reload:
+            return self._assets.get(path)
+        full_path = self._full_path(path)
+        if full_path is None:
+            return None
+        try:
+            mtime = os.stat(full_path).st_mtime
+        except (OSError, ValueError):
+            with self._lock:
+                self._assets.pop(path, None)
+            return None
+        asset = self._assets.get(path)
+        if asset is None or asset.mtime != mtime:
+            asset = self._load(path)
+            with self._lock:
+                if asset is None:
+                    self._assets.pop(path, None)
+                else:
+                    self._assets[path] = asset
+        return asset
+
+    def on_disk_only(self, path):
+        if self.hot_reload:
+            full_path = self._full_path(path)
+            return full_path is not None and os.path.isfile(full_path)
+        return path in self._large
+
+    def serve(self, asset):
+        """Response for `asset` in the best encoding the client accepts, 304 when its ETag matches"""
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        # Strong ETags must differ between encodings of the same file
+        etag = asset.etag if encoding == 'identity' else f'{asset.etag}-{encoding}'
+
+        headers = {'Cache-Control': asset.cache_control, 'Vary': 'Accept-Encoding'}
+        if request.if_none_match.contains(etag):
+            response = Response(status=304, headers=headers)
+            response.set_etag(etag)
+            return response
+
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype, headers=headers)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        return response
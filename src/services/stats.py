@@ -0,0 +1,93 @@
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db, Quiz, QuizResult, UserStats, QuizStats, DocumentStats
+
+STATS_MODELS = (
+    # (model, key column on the stats table, key taken from each result row)
+    (UserStats, 'user_id', 'user_id'),
+    (QuizStats, 'quiz_id', 'quiz_id'),
+    (DocumentStats, 'document_id', 'document_id'),
+)
+
+
+def _totals(rows, field):
+    totals = {}
+    for row in rows:
+        key = row[field]
+        entry = totals.setdefault(key, {
+            'attempts': 0, 'score_sum': 0, 'question_sum': 0,
+            'percentage_sum': 0.0, 'best_percentage': 0.0, 'last_attempt_at': None
+        })
+        entry['attempts'] += 1
+        entry['score_sum'] += row['score']
+        entry['question_sum'] += row['total_questions']
+        entry['percentage_sum'] += row['percentage']
+        entry['best_percentage'] = max(entry['best_percentage'], row['percentage'])
+        if entry['last_attempt_at'] is None or row['completed_at'] > entry['last_attempt_at']:
+            entry['last_attempt_at'] = row['completed_at']
+    return totals
+
+
+def _add(model, key_column, key, totals):
+    """Fold totals into one stats row with a single UPDATE, inserting it the first time"""
+    column = getattr(model, key_column)
+    updated = model.query.filter(column == key).update({
+        'attempts': model.attempts + totals['attempts'],
+        'score_sum': model.score_sum + totals['score_sum'],
+        'question_sum': model.question_sum + totals['question_sum'],
+        'percentage_sum': model.percentage_sum + totals['percentage_sum'],
+        'best_percentage': db.case(
+            (model.best_percentage < totals['best_percentage'], totals['best_percentage']),
+            else_=model.best_percentage
+        ),
+        'last_attempt_at': totals['last_attempt_at']
+    }, synchronize_session=False)
+    if updated:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**{key_column: key}, **totals))
+    except IntegrityError:
+        # Created concurrently, fold into that row instead
+        _add(model, key_column, key, totals)
+
+
+def record_results(quiz, rows):
+    """Update the per user, quiz and document aggregates for newly inserted results, without committing.
+
+    `rows` are dicts with user_id, score, total_questions, percentage and
+    completed_at, as built for QuizResult.
+    """
+    rows = [dict(row, quiz_id=quiz.id, document_id=quiz.document_id) for row in rows]
+    for model, key_column, field in STATS_MODELS:
+        for key, totals in _totals(rows, field).items():
+            _add(model, key_column, key, totals)
+
+
+def rebuild_stats():
+    """Recompute every aggregate from QuizResult history"""
+    for model, _, _ in STATS_MODELS:
+        model.query.delete()
+
+    groups = (
+        (UserStats, 'user_id', QuizResult.user_id),
+        (QuizStats, 'quiz_id', QuizResult.quiz_id),
+        (DocumentStats, 'document_id', Quiz.document_id),
+    )
+    for model, key_column, key in groups:
+        query = db.select(
+            key,
+            db.func.count(QuizResult.id),
+            db.func.sum(QuizResult.score),
+            db.func.sum(QuizResult.total_questions),
+            db.func.sum(QuizResult.percentage),
+            db.func.max(QuizResult.percentage),
+            db.func.max(QuizResult.completed_at)
+        ).select_from(QuizResult).join(Quiz, Quiz.id == QuizResult.quiz_id).group_by(key)
+        db.session.execute(db.insert(model).from_select(
+            [key_column, 'attempts', 'score_sum', 'question_sum', 'percentage_sum',
+             'best_percentage', 'last_attempt_at'],
+            query
+        ))
+    db.session.commit()
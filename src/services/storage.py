@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from src.models.user import db, Document, StoredFile, PassageIndex
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads'))
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# Create upload folder if it doesn't exist
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+
+def hash_file(file_path, block_size=STREAM_BLOCK_SIZE):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _add_reference(sha256):
+    """Count one more document for an existing file, False if there is no such file"""
+    return StoredFile.query.filter_by(sha256=sha256) \
+        .update({'ref_count': StoredFile.ref_count + 1}, synchronize_session=False) == 1
+
+
+def register_file(path, sha256, size, file_type, extension):
+    """Move a file whose hash is known into content-addressed storage and reference it.
+
+    Returns (stored_file, created). When the bytes are already stored the
+    given file is removed and the existing StoredFile gains a reference.
+    """
+    if _add_reference(sha256):
+        os.remove(path)
+        return db.session.get(StoredFile, sha256, populate_existing=True), False
+
+    final_path = os.path.join(UPLOAD_FOLDER, f'{sha256}.{extension}')
+    os.replace(path, final_path)
+    stored_file = StoredFile(
+        sha256=sha256,
+        file_path=final_path,
+        file_type=file_type,
+        size=size,
+        ref_count=1,
+        status='pending'
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(stored_file)
+    except IntegrityError:
+        # A concurrent upload of the same bytes inserted the row first
+        _add_reference(sha256)
+        return db.session.get(StoredFile, sha256, populate_existing=True), False
+    return stored_file, True
+
+
+def register_text(text, file_path, file_type):
+    """Reference a stored file holding already extracted text whose original file is gone.
+
+    Used for documents from before content-addressed storage. The hash is
+    taken over the text and the file is recorded as fully extracted, so
+    nothing ever tries to read `file_path`. Returns (stored_file, created).
+    """
+    from src.services.extraction import PREVIEW_CHARS
+    from src.services.passages import update_passage_index
+
+    data = text.encode('utf-8')
+    sha256 = hashlib.sha256(data).hexdigest()
+    if _add_reference(sha256):
+        return db.session.get(StoredFile, sha256, populate_existing=True), False
+
+    stored_file = StoredFile(
+        sha256=sha256,
+        file_path=file_path,
+        file_type=file_type,
+        size=len(data),
+        ref_count=1,
+        content_text=text,
+        content_preview=text[:PREVIEW_CHARS],
+        char_count=len(text),
+        page_count=1,
+        extracted_pages=1,
+        status='ready'
+    )
+    with db.session.begin_nested():
+        db.session.add(stored_file)
+    update_passage_index(stored_file)
+    return stored_file, True
+
+
+def store_upload(file, file_type, extension):
+    """Stream an uploaded file to disk while hashing it, see register_file for the result"""
+    part_path = os.path.join(UPLOAD_FOLDER, f'.{uuid.uuid4()}.part')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(part_path, 'wb') as out:
+            for block in iter(lambda: file.stream.read(STREAM_BLOCK_SIZE), b''):
+                digest.update(block)
+                out.write(block)
+                size += len(block)
+        return register_file(part_path, digest.hexdigest(), size, file_type, extension)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+
+@event.listens_for(Document, 'after_delete')
+def _release_file(mapper, connection, document):
+    """Drop the document's reference; the last one removes the stored file after commit"""
+    session = Session.object_session(document)
+    if not document.file_hash:
+        # Documents uploaded before deduplication own their file
+        session.info.setdefault('orphaned_files', []).append(document.file_path)
+        return
+
+    table = StoredFile.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.sha256 == document.file_hash)
+        .values(ref_count=table.c.ref_count - 1)
+    )
+    file_path = connection.execute(
+        db.select(table.c.file_path).where(table.c.sha256 == document.file_hash, table.c.ref_count <= 0)
+    ).scalar()
+    if file_path is not None:
+        index_table = PassageIndex.__table__
+        connection.execute(index_table.delete().where(index_table.c.sha256 == document.file_hash))
+        connection.execute(table.delete().where(table.c.sha256 == document.file_hash, table.c.ref_count <= 0))
+        session.info.setdefault('orphaned_files', []).append(file_path)
+
+
+@event.listens_for(Session, 'after_commit')
+def _remove_orphaned_files(session):
+    for file_path in session.info.pop('orphaned_files', []):
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except OSError as e:
+            logger.warning('Could not remove %s: %s', file_path, e)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_orphaned_files(session):
+    session.info.pop('orphaned_files', None)
@@ -0,0 +1,130 @@
+import uuid
+from datetime import datetime
+
+from src.models.user import db, User, TokenTransaction, TokenReservation
+from src.services.user_cache import invalidate_user
+
+
+class InsufficientTokens(Exception):
+    pass
+
+
+class UnknownUser(Exception):
+    pass
+
+
+def record_transaction(user_id, amount, kind, balance_after, reference=None):
+    """Append a ledger entry to the current transaction without committing"""
+    db.session.add(TokenTransaction(
+        user_id=user_id,
+        amount=amount,
+        kind=kind,
+        balance_after=balance_after,
+        reference=reference
+    ))
+
+
+def _apply(user_id, amount, kind, reference):
+    """Change the balance with one conditional UPDATE ... RETURNING and log it; returns the new balance"""
+    statement = db.update(User).where(User.id == user_id)
+    if amount < 0:
+        statement = statement.where(User.tokens >= -amount)
+    balance = db.session.execute(
+        statement.values(tokens=User.tokens + amount).returning(User.tokens),
+        execution_options={'synchronize_session': False}
+    ).scalar()
+
+    if balance is None:
+        if db.session.query(User.id).filter_by(id=user_id).first() is None:
+            raise UnknownUser(user_id)
+        raise InsufficientTokens(user_id)
+
+    record_transaction(user_id, amount, kind, balance, reference)
+    invalidate_user(user_id)
+    return balance
+
+
+def credit(user_id, amount, kind='purchase', reference=None):
+    """Add tokens and commit, returning the new balance"""
+    try:
+        balance = _apply(user_id, amount, kind, reference)
+        db.session.commit()
+        return balance
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def debit(user_id, amount, kind='debit', reference=None):
+    """Remove tokens if the balance allows it and commit, returning the new balance"""
+    try:
+        balance = _apply(user_id, -amount, kind, reference)
+        db.session.commit()
+        return balance
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def reserve(user_id, amount, reference=None):
+    """Hold tokens for work that may still fail.
+
+    The tokens leave the balance right away and the hold is committed, so the
+    row lock is released before any slow work starts. Settle it with
+    commit_reservation() or refund_reservation().
+    """
+    try:
+        reservation = TokenReservation(id=str(uuid.uuid4()), user_id=user_id, amount=amount, reference=reference)
+        balance = _apply(user_id, -amount, 'reserve', f'reservation:{reservation.id}')
+        db.session.add(reservation)
+        db.session.commit()
+        return reservation, balance
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def commit_reservation(reservation_id, reference=None, amount=None):
+    """Keep the held tokens; safe to call in the same transaction as the work it pays for.
+
+    With `amount` only that many tokens are kept and the rest of the hold goes
+    back to the balance. Returns the number of tokens given back, or None if
+    the reservation was already settled.
+    """
+    reservation = db.session.get(TokenReservation, reservation_id)
+    if reservation is None:
+        return None
+    kept = reservation.amount if amount is None else max(0, min(amount, reservation.amount))
+    values = {'status': 'committed', 'settled_at': datetime.utcnow(), 'amount': kept}
+    if reference:
+        values['reference'] = reference
+    settled = TokenReservation.query.filter_by(id=reservation_id, status='held') \
+        .update(values, synchronize_session=False)
+    if settled != 1:
+        return None
+    returned = reservation.amount - kept
+    if returned:
+        _apply(reservation.user_id, returned, 'refund', f'reservation:{reservation_id}')
+    return returned
+
+
+def refund_reservation(reservation_id):
+    """Return held tokens to the balance and commit, returning the new balance (None if already settled)"""
+    try:
+        reservation = db.session.get(TokenReservation, reservation_id)
+        settled = TokenReservation.query.filter_by(id=reservation_id, status='held') \
+            .update({'status': 'refunded', 'settled_at': datetime.utcnow()}, synchronize_session=False)
+        if settled != 1:
+            db.session.rollback()
+            return None
+        balance = _apply(reservation.user_id, reservation.amount, 'refund', f'reservation:{reservation_id}')
+        db.session.commit()
+        return balance
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def ledger_balance(user_id):
+    return db.session.query(db.func.coalesce(db.func.sum(TokenTransaction.amount), 0)) \
+        .filter(TokenTransaction.user_id == user_id).scalar()
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from src.models.user import db, User
+
+USER_CACHE_ENABLED = os.getenv('USER_CACHE_ENABLED', '1') != '0'
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+# Invalidation is per process, the TTL bounds how long other workers can serve a stale balance
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '5'))  # seconds
+
+_snapshots = OrderedDict()
+_lock = threading.Lock()
+_generation = 0  # Bumped on every invalidation so a load racing a write is not cached
+
+
+def _build_snapshot(user):
+    data = user.to_dict()
+    payload = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return {'user': data, 'etag': hashlib.sha1(payload.encode('utf-8')).hexdigest()}
+
+
+def get_user_snapshot(user_id):
+    """Return {'user': user.to_dict(), 'etag': ...} for a user, or None when it does not exist.
+
+    Snapshots are served from memory for USER_CACHE_TTL seconds and dropped
+    as soon as a change to the user commits in this process.
+    """
+    if USER_CACHE_ENABLED:
+        with _lock:
+            entry = _snapshots.get(user_id)
+            if entry is not None:
+                snapshot, stored_at = entry
+                if monotonic() - stored_at <= USER_CACHE_TTL:
+                    _snapshots.move_to_end(user_id)
+                    return snapshot
+                del _snapshots[user_id]
+            generation = _generation
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    snapshot = _build_snapshot(user)
+
+    if USER_CACHE_ENABLED:
+        with _lock:
+            if generation == _generation:
+                _snapshots[user_id] = (snapshot, monotonic())
+                while len(_snapshots) > USER_CACHE_SIZE:
+                    _snapshots.popitem(last=False)
+    return snapshot
+
+
+def _evict(user_ids):
+    global _generation
+    with _lock:
+        _generation += 1
+        for user_id in user_ids:
+            _snapshots.pop(user_id, None)
+
+
+def invalidate_user(user_id):
+    """Drop a user's snapshot now and again once the current transaction commits"""
+    _evict([user_id])
+    db.session.info.setdefault('invalidated_users', set()).add(user_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_user_changes(session, flush_context):
+    # Catches profile edits and deletes made through the ORM; balance updates
+    # bypass the unit of work and call invalidate_user() from the token ledger
+    user_ids = {obj.id for obj in list(session.dirty) + list(session.deleted) if isinstance(obj, User)}
+    if user_ids:
+        _evict(user_ids)
+        session.info.setdefault('invalidated_users', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_committed_users(session):
+    user_ids = session.info.pop('invalidated_users', None)
+    if user_ids:
+        _evict(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_invalidated_users(session):
+    session.info.pop('invalidated_users', None)